@@ -0,0 +1,150 @@
+"""
+Shared helpers for the request_utils benchmarks.
+
+The benchmarks are plain scripts meant to be run from a checkout, e.g.::
+
+    python benchmarks/bench_clone.py
+
+"""
+import gc
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"
+))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(INSTALLED_APPS=["request_utils"])
+
+from django import template
+from django.http import QueryDict
+from django.test import RequestFactory
+
+request_factory = RequestFactory()
+
+def get_request(path="/", params=None):
+    return request_factory.get(path, params or {})
+
+def make_query_dict(size, mutable=False):
+    """
+    Return a ``QueryDict`` with ``size`` keys holding two values each.
+    """
+    query_dict = QueryDict("", mutable=True)
+    for i in xrange(size):
+        query_dict.setlist("key%d" % i, ["value%d" % i, "other%d" % i])
+    query_dict._mutable = mutable
+    return query_dict
+
+def compile_template(string):
+    return template.Template("{% load request_utils %}" + string)
+
+def measure(func, repeat=5, number=10):
+    """
+    Return the best time per call of ``func`` in seconds.
+    """
+    func()
+    best = None
+    gc.disable()
+    try:
+        for _ in xrange(repeat):
+            start = time.time()
+            for _ in xrange(number):
+                func()
+            elapsed = (time.time() - start) / number
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        gc.enable()
+    return best
+
+def get_max_rss():
+    """
+    Return the maximum resident set size of this process in bytes.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return max_rss
+    return max_rss * 1024
+
+def peak_memory(setup, *args):
+    """
+    Return the peak memory in bytes used by one call of the function returned
+    by ``setup(*args)``.
+
+    The call is made in a fresh interpreter, where it is the first one, and
+    measured by how much it grows the maximum resident set size. ``setup``
+    must be a module level function of a benchmark script and ``args`` must
+    survive ``repr``. The result is only as precise as a memory page, so it
+    is meaningful for large inputs only.
+    """
+    module = setup.__module__
+    if module == "__main__":
+        module = os.path.splitext(
+            os.path.basename(sys.modules["__main__"].__file__)
+        )[0]
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), module, setup.__name__,
+         repr(args)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return int(output)
+
+def best_time(func, setup=None, repeat=5):
+    """
+    Return the best time in seconds of a single call of ``func``, passing it
+    the result of calling ``setup`` when given. Only ``func`` is timed.
+    """
+    best = None
+    gc.disable()
+    try:
+        for _ in xrange(repeat):
+            if setup is None:
+                start = time.time()
+                func()
+            else:
+                arg = setup()
+                start = time.time()
+                func(arg)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        gc.enable()
+    return best
+
+def report(title, columns, rows):
+    """
+    Print a simple aligned table of benchmark results.
+    """
+    table = [list(columns)]
+    for row in rows:
+        cells = []
+        for cell in row:
+            if cell is None:
+                cells.append("n/a")
+            elif isinstance(cell, float):
+                cells.append("%.6f" % cell)
+            else:
+                cells.append(str(cell))
+        table.append(cells)
+    widths = [max(14, max([len(row[i]) for row in table]))
+              for i in xrange(len(columns))]
+    print(title)
+    for row in table:
+        print("  ".join([cell.rjust(width) for cell, width in zip(row, widths)]))
+    print("")
+
+if __name__ == "__main__":
+    # Run by ``peak_memory``: python base.py <module> <setup> <args>
+    setup = getattr(__import__(sys.argv[1]), sys.argv[2])
+    func = setup(*eval(sys.argv[3]))
+    gc.collect()
+    before = get_max_rss()
+    func()
+    print(get_max_rss() - before)
@@ -0,0 +1,62 @@
+"""
+Compare ``clone_query_dict`` in a facet loop when the source ``QueryDict`` is
+immutable (shared through a ``QueryDictOverlay``) and when it is mutable
+(copied in full on every iteration).
+
+The loop only keeps one clone alive at a time, so memory is measured on
+clones made with the same functions as the tags and all kept alive: the peak
+grows with the memory each clone takes. With few keys or facets it is below
+the precision of the measure.
+"""
+from base import compile_template, make_query_dict, measure, peak_memory, report
+
+from django import template
+
+from request_utils.query import clone_query_dict, replace_key
+
+FACET_LOOP = compile_template(
+    '{% for value in facets %}'
+    '{% clone_query_dict query_dict as "q" %}'
+    '{% replace_key q "facet" value %}'
+    '{{ q.urlencode }}'
+    '{% endfor %}'
+)
+
+def make_facet_loop(facets, size, mutable):
+    context = template.Context({
+        "query_dict": make_query_dict(size, mutable=mutable),
+        "facets": ["facet%d" % i for i in xrange(facets)],
+    })
+    return lambda: FACET_LOOP.render(context)
+
+def make_facet_clones(facets, size, mutable):
+    query_dict = make_query_dict(size, mutable=mutable)
+    values = ["facet%d" % i for i in xrange(facets)]
+    def clone_all():
+        clones = []
+        for value in values:
+            clone = clone_query_dict(query_dict)
+            replace_key(clone, "facet", value)
+            clones.append(clone)
+        return clones
+    return clone_all
+
+def run(facet_counts=(10, 50, 200), sizes=(20, 1000)):
+    for size in sizes:
+        rows = []
+        for facets in facet_counts:
+            rows.append((
+                facets,
+                measure(make_facet_loop(facets, size, True), number=1),
+                measure(make_facet_loop(facets, size, False), number=1),
+                peak_memory(make_facet_clones, facets, size, True),
+                peak_memory(make_facet_clones, facets, size, False),
+            ))
+        report(
+            "clone_query_dict in a facet loop (%d keys)" % size,
+            ("facets", "copy (s)", "overlay (s)", "copy (B)", "overlay (B)"),
+            rows,
+        )
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,43 @@
+"""
+Compare building facet toggle links with a ``clone_query_dict`` and an
+``append_key`` or ``delete_key`` per value against ``facet_links``.
+"""
+from base import make_query_dict, measure, report
+
+from request_utils.query import (
+    append_key, clone_query_dict, delete_key, facet_links
+)
+
+def run(sizes=(1, 10, 100), counts=(10, 100, 500)):
+    rows = []
+    for size in sizes:
+        query_dict = make_query_dict(size)
+        for count in counts:
+            values = ["value%d" % i for i in xrange(count)]
+
+            def per_value():
+                selected = query_dict.getlist("key0")
+                for value in values:
+                    clone = clone_query_dict(query_dict)
+                    if value in selected:
+                        delete_key(clone, "key0")
+                        for other in selected:
+                            if other != value:
+                                append_key(clone, "key0", other)
+                    else:
+                        append_key(clone, "key0", value)
+                    "?" + clone.urlencode()
+
+            def batched():
+                facet_links(query_dict, "key0", values)
+
+            rows.append((size, count, measure(per_value) * 1e3,
+                         measure(batched) * 1e3))
+    report(
+        "Facet toggle links (milliseconds)",
+        ("keys", "values", "per value", "facet_links"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
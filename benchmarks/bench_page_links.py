@@ -0,0 +1,47 @@
+"""
+Compare rendering a paginator with a ``clone_query_dict``, ``replace_key``
+and ``urlencode`` per page against a single ``page_links`` tag.
+"""
+from base import compile_template, get_request, make_query_dict, measure, report
+
+from django import template
+from django.core.paginator import Paginator
+
+PER_PAGE_TEMPLATE = compile_template(
+    '{% for number in page.paginator.page_range %}'
+    '{% clone_query_dict request.GET as "q" %}'
+    '{% replace_key q "page" number %}'
+    '<a href="?{{ q.urlencode }}">{{ number }}</a>'
+    '{% endfor %}'
+)
+
+PAGE_LINKS_TEMPLATE = compile_template(
+    '{% page_links request.GET "page" page window=5 as "links" %}'
+    '{% for number, url, current in links %}'
+    '{% if number %}<a href="{{ url }}">{{ number }}</a>{% else %}...{% endif %}'
+    '{% endfor %}'
+)
+
+def run(sizes=(1, 10, 100), pages=(10, 100)):
+    rows = []
+    for size in sizes:
+        params = dict(make_query_dict(size).items())
+        for num_pages in pages:
+            page = Paginator(range(num_pages), 1).page(num_pages // 2)
+            context = template.Context({
+                "request": get_request("/list/", params),
+                "page": page,
+            })
+            rows.append((
+                size, num_pages,
+                measure(lambda: PER_PAGE_TEMPLATE.render(context)) * 1e3,
+                measure(lambda: PAGE_LINKS_TEMPLATE.render(context)) * 1e3,
+            ))
+    report(
+        "Paginator rendering (milliseconds)",
+        ("keys", "pages", "per page", "page_links"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
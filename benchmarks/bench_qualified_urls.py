@@ -0,0 +1,53 @@
+"""
+Compare qualifying many paths with a ``qualified_url`` tag per path against
+a single ``qualified_urls`` tag, and ``request.build_absolute_uri`` against
+the ``qualified_urls`` generator.
+"""
+from base import compile_template, get_request, measure, report
+
+from django import template
+
+from request_utils.query import qualified_urls
+
+PER_PATH_TEMPLATE = compile_template(
+    '{% for path in paths %}{% qualified_url path %}\n{% endfor %}'
+)
+
+# Autoescaping is turned off so that both templates do the same work: the
+# output of qualified_url is not escaped either.
+BULK_TEMPLATE = compile_template(
+    '{% qualified_urls paths as "urls" %}{% autoescape off %}'
+    '{% for url in urls %}{{ url }}\n{% endfor %}{% endautoescape %}'
+)
+
+def run(counts=(100, 1000, 10000)):
+    rows = []
+    request = get_request("/sitemap.xml")
+    for count in counts:
+        paths = ["/item/%d/" % i for i in xrange(count)]
+        context = template.Context({"request": request, "paths": paths})
+
+        def per_call():
+            for path in paths:
+                request.build_absolute_uri(path)
+
+        def generator():
+            for url in qualified_urls(paths, request):
+                pass
+
+        rows.append((
+            count,
+            measure(lambda: PER_PATH_TEMPLATE.render(context), number=1) * 1e3,
+            measure(lambda: BULK_TEMPLATE.render(context), number=1) * 1e3,
+            measure(per_call, number=1) * 1e3,
+            measure(generator, number=1) * 1e3,
+        ))
+    report(
+        "Qualifying paths (milliseconds)",
+        ("paths", "qualified_url", "qualified_urls", "request",
+         "generator"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,42 @@
+"""
+Compare Django's eager ``QueryDict`` parsing with ``LazyQueryDict``, as
+installed by ``LazyQueryDictMiddleware``, for typical and adversarial query
+strings. Each run parses the query string and reads one key.
+"""
+from base import measure, report
+
+from django.http import QueryDict
+
+from request_utils.datastructures import LazyQueryDict
+
+QUERY_STRINGS = (
+    ("small", "q=shoes&sort=price&page=2"),
+    ("50 keys", "&".join(["key%d=value%d" % (i, i) for i in xrange(50)])),
+    ("5000 repeats", "page=2&" + "&".join(["a=%E9t%E9"] * 5000)),
+    ("long values", "page=2&" + "&".join(["k%d=%s" % (i, "x" * 10000)
+                                          for i in xrange(10)])),
+)
+
+def run(number=100):
+    rows = []
+    for name, query_string in QUERY_STRINGS:
+        def eager():
+            for _ in xrange(number):
+                QueryDict(query_string).get("page")
+
+        def lazy():
+            for _ in xrange(number):
+                LazyQueryDict(
+                    query_string, max_keys=1000, max_value_length=4096
+                ).get("page")
+
+        rows.append((name, len(query_string), measure(eager, number=1) * 1e3,
+                     measure(lazy, number=1) * 1e3))
+    report(
+        "%d parses and one lookup (milliseconds)" % number,
+        ("query string", "length", "QueryDict", "LazyQueryDict"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
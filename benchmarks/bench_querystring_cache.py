@@ -0,0 +1,36 @@
+"""
+Compare building paginator links with ``urlencode_with_changes`` with and
+without a ``QueryStringTemplateCache``.
+"""
+from base import make_query_dict, measure, report
+
+from request_utils.encoding import (
+    QueryStringTemplateCache, urlencode_with_changes
+)
+
+def run(sizes=(10, 100), links=100):
+    rows = []
+    for size in sizes:
+        query_dict = make_query_dict(size)
+
+        def uncached():
+            for page in xrange(links):
+                urlencode_with_changes(query_dict, [("page", [page])])
+
+        def cached():
+            cache = QueryStringTemplateCache()
+            for page in xrange(links):
+                urlencode_with_changes(
+                    query_dict, [("page", [page])], cache=cache
+                )
+
+        rows.append((size, measure(uncached) * 1e3,
+                     measure(cached) * 1e3))
+    report(
+        "%d paginator links (milliseconds)" % links,
+        ("keys", "uncached", "cached"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,32 @@
+"""
+Compare resolving the ``request`` context variable with a ``Variable``
+created on every call, as the location tags used to, against the lookup
+compiled once when the node is created.
+"""
+from base import get_request, measure, report
+
+from django import template
+
+from request_utils.templatetags.request_utils import REQUEST_VARIABLE
+
+def run(number=1000):
+    context = template.Context({"request": get_request("/foo/")})
+
+    def per_call():
+        for _ in xrange(number):
+            template.Variable("request").resolve(context)
+
+    def precompiled():
+        for _ in xrange(number):
+            REQUEST_VARIABLE.resolve(context)
+
+    per_call_time = measure(per_call) / number * 1e6
+    precompiled_time = measure(precompiled) / number * 1e6
+    report(
+        "request lookup per call (microseconds)",
+        ("per call", "compiled"),
+        [(per_call_time, precompiled_time)],
+    )
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,37 @@
+"""
+Compare building a small querystring from scratch in a ``QueryDict`` and in
+a ``ScratchQueryDict``, as the ``query_dict`` tag does in loops.
+"""
+from base import measure, report
+
+from django.http import QueryDict
+
+from request_utils.datastructures import ScratchQueryDict
+
+def run(keys=(0, 1, 5), number=1000):
+    rows = []
+    for count in keys:
+        pairs = [("key%d" % i, "value%d" % i) for i in xrange(count)]
+
+        def build(factory):
+            def func():
+                for _ in xrange(number):
+                    query_dict = factory()
+                    for key, value in pairs:
+                        query_dict.appendlist(key, value)
+                    query_dict.urlencode()
+            return func
+
+        rows.append((
+            count,
+            measure(build(lambda: QueryDict("", mutable=True))) * 1e3,
+            measure(build(ScratchQueryDict)) * 1e3,
+        ))
+    report(
+        "%d scratch querystrings (milliseconds)" % number,
+        ("keys", "QueryDict", "ScratchQueryDict"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
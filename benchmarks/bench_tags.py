@@ -0,0 +1,124 @@
+"""
+Benchmark compiling and rendering every tag in the ``request_utils`` tag
+library, for a range of ``QueryDict`` sizes and tag invocations per template.
+
+Usage::
+
+    python benchmarks/bench_tags.py [--output results.json] [--tag name ...]
+
+With ``--output``, the results are also written as JSON for regression
+tracking.
+"""
+import json
+import optparse
+import platform
+
+import django
+
+from base import (
+    best_time, compile_template, get_request, make_query_dict, report
+)
+
+from django import template
+from django.core.paginator import Paginator
+from django.template.loader import get_template_from_string
+
+TAG_SNIPPETS = {
+    "append_key": '{% append_key qd "key0" "x" %}',
+    "replace_key": '{% replace_key qd "key0" "x" %}',
+    "delete_key": '{% delete_key qd "key0" %}',
+    "update_query_dict": '{% update_query_dict qd other %}',
+    "clone_query_dict": '{% clone_query_dict request.GET as "q" %}',
+    "freeze_query_dict": '{% freeze_query_dict request.GET as "f" %}',
+    "query_dict": '{% query_dict as "q" %}',
+    "qualified_url": '{% qualified_url "/foo/" %}',
+    "current_location": '{% current_location %}',
+    "modified_url": '{% modified_url request.GET key0="x" -key1 %}',
+    "page_links": '{% page_links request.GET "page" page as "links" %}',
+    "facet_links": '{% facet_links request.GET "key0" facets as "links" %}',
+    "sort_links": '{% sort_links request.GET "key0" "a,b,c" as "links" %}',
+    "qualified_urls": (
+        '{% qualified_urls paths as "urls" %}{% for url in urls %}{% endfor %}'
+    ),
+    "cache_by_query": (
+        '{% cache_by_query 60 keys="key0,key1" %}x{% end_cache_by_query %}'
+    ),
+    "edit_query_dict": (
+        '{% edit_query_dict request.GET as "q" %}'
+        '{% replace "key0" "x" %}{% delete "key1" %}'
+        '{% end_edit_query_dict %}'
+    ),
+}
+
+SIZES = (1, 10, 100)
+INVOCATIONS = (1, 10, 100)
+
+def make_context(size):
+    query_dict = make_query_dict(size)
+    request = get_request("/path/", dict(query_dict.items()))
+    request.GET
+    return template.Context({
+        "request": request,
+        "qd": make_query_dict(size, mutable=True),
+        "other": {"extra": "1"},
+        "page": Paginator(range(1000), 10).page(50),
+        "facets": ["value0", "a", "b", "c"],
+        "paths": ["/item/%d/" % i for i in xrange(10)],
+    })
+
+def run_tag(tag, sizes=SIZES, invocations=INVOCATIONS, repeat=5):
+    results = []
+    for count in invocations:
+        source = "{% load request_utils %}" + TAG_SNIPPETS[tag] * count
+        compile_seconds = best_time(
+            lambda: get_template_from_string(source), repeat=repeat
+        )
+        compiled = compile_template(TAG_SNIPPETS[tag] * count)
+        for size in sizes:
+            render_seconds = best_time(
+                compiled.render, lambda: make_context(size), repeat=repeat
+            )
+            results.append({
+                "tag": tag,
+                "size": size,
+                "invocations": count,
+                "compile_seconds": compile_seconds,
+                "render_seconds": render_seconds,
+            })
+    return results
+
+def run(tags=None, output=None):
+    results = []
+    for tag in sorted(tags or TAG_SNIPPETS):
+        results.extend(run_tag(tag))
+    report(
+        "tag compile and render times (milliseconds)",
+        ("tag", "keys", "invocations", "compile", "render"),
+        [(result["tag"], result["size"], result["invocations"],
+          result["compile_seconds"] * 1e3, result["render_seconds"] * 1e3)
+         for result in results],
+    )
+    if output:
+        f = open(output, "w")
+        try:
+            json.dump({
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    return results
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-o", "--output", help="write JSON results to a file")
+    parser.add_option(
+        "-t", "--tag", action="append", dest="tags", choices=sorted(TAG_SNIPPETS),
+        help="only benchmark the given tag; may be given more than once",
+    )
+    options, args = parser.parse_args()
+    run(options.tags, options.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Compare ``QueryDict.urlencode`` with the streaming
+``request_utils.encoding.urlencode`` for QueryDicts of increasing size.
+
+Both take about the same time; the streaming encoder saves memory, as it
+writes each argument to one buffer instead of keeping a list of every
+encoded argument until they are joined. Memory is only measured to the
+page, so small sizes may show no difference.
+"""
+from base import make_query_dict, measure, peak_memory, report
+
+from request_utils.encoding import urlencode
+
+def make_django_urlencode(size):
+    return make_query_dict(size).urlencode
+
+def make_streaming_urlencode(size):
+    query_dict = make_query_dict(size)
+    return lambda: urlencode(query_dict)
+
+def run(sizes=(10, 100, 1000, 10000, 100000)):
+    rows = []
+    for size in sizes:
+        rows.append((
+            size,
+            measure(make_django_urlencode(size), number=1) * 1e3,
+            measure(make_streaming_urlencode(size), number=1) * 1e3,
+            peak_memory(make_django_urlencode, size),
+            peak_memory(make_streaming_urlencode, size),
+        ))
+    report(
+        "urlencode of keys with two values each (milliseconds, bytes)",
+        ("keys", "QueryDict", "streaming", "QueryDict (B)", "streaming (B)"),
+        rows,
+    )
+
+if __name__ == "__main__":
+    run()
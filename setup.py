@@ -13,7 +13,12 @@ setup(
     author = 'Jeff Kistler',
     author_email = 'jeff@jeffkistler.com',
     url = 'https://github.com/jeffkistler/django-request-utils',
-    packages = ['request_utils', 'request_utils.templatetags'],
+    packages = [
+        'request_utils',
+        'request_utils.management',
+        'request_utils.management.commands',
+        'request_utils.templatetags',
+    ],
     package_dir = {'': 'src'},
     classifiers = [
         'Development Status :: 3 - Alpha',
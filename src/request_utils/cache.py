@@ -0,0 +1,54 @@
+from django.utils.datastructures import SortedDict
+
+class LRUCache(object):
+    """
+    A mapping holding at most ``max_size`` items, discarding the least
+    recently used item when full.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = SortedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self.data:
+            del self.data[key]
+        elif len(self.data) >= self.max_size:
+            del self.data[self.data.keyOrder[0]]
+        self.data[key] = value
+
+    def clear(self):
+        self.data.clear()
+
+def snapshot_query_dict(query_dict):
+    """
+    Return a snapshot of the contents of ``query_dict`` to be compared with
+    ``matches_snapshot`` later.
+    """
+    return dict((key, list_[:]) for key, list_ in query_dict.lists())
+
+def matches_snapshot(query_dict, snapshot):
+    """
+    Return whether ``query_dict`` still has the contents recorded in
+    ``snapshot``. For dictionary based ``QueryDict`` objects this is a single
+    C level comparison, much cheaper than encoding the ``QueryDict``.
+    """
+    # The query dicts of request_utils.datastructures are MultiValueDicts
+    # that leave the dictionary they inherit empty, so only a non-empty
+    # dictionary holds the contents.
+    if isinstance(query_dict, dict) and dict.__len__(query_dict):
+        return dict.__eq__(snapshot, query_dict)
+    return snapshot == dict(query_dict.lists())
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.http import QueryDict
+
+from request_utils.datastructures import FrozenQueryDict
+from request_utils.encoding import QueryStringWriter
+
+DEFAULT_DENYLIST = ("utm_*", "gclid", "fbclid")
+
+_denylists = {}
+
+def get_denylist(denylist=None):
+    """
+    Return a function telling whether a key is denied by ``denylist``, a
+    sequence of key names where a trailing ``*`` matches any suffix.
+
+    Defaults to the ``REQUEST_UTILS_CANONICAL_DENYLIST`` setting. Compiled
+    denylists are cached.
+    """
+    if denylist is None:
+        denylist = getattr(
+            settings, "REQUEST_UTILS_CANONICAL_DENYLIST", DEFAULT_DENYLIST
+        )
+    denylist = tuple(denylist)
+    try:
+        return _denylists[denylist]
+    except KeyError:
+        pass
+    names = frozenset([name for name in denylist if not name.endswith("*")])
+    prefixes = tuple([name[:-1] for name in denylist if name.endswith("*")])
+    if prefixes:
+        def is_denied(key):
+            return key in names or key.startswith(prefixes)
+    else:
+        is_denied = names.__contains__
+    _denylists[denylist] = is_denied
+    return is_denied
+
+def canonical_lists(query_dict, denylist=None):
+    """
+    Return the ``(key, values)`` pairs of ``query_dict`` in canonical form:
+    keys and values sorted, empty values and denied keys left out.
+    """
+    is_denied = get_denylist(denylist)
+    result = []
+    for key, values in sorted(query_dict.lists()):
+        if is_denied(key):
+            continue
+        values = sorted([value for value in values if value != u""])
+        if values:
+            result.append((key, values))
+    return result
+
+def canonical_querystring(query_dict, denylist=None):
+    """
+    Return the canonical encoded querystring of ``query_dict``, so that
+    equivalent querystrings encode the same.
+    """
+    writer = QueryStringWriter(query_dict.encoding)
+    writer.write_lists(canonical_lists(query_dict, denylist))
+    return writer.getvalue()
+
+def canonical_query_dict(query_dict, denylist=None):
+    """
+    Return a ``FrozenQueryDict`` with the canonical contents of
+    ``query_dict``.
+    """
+    return FrozenQueryDict(
+        canonical_lists(query_dict, denylist), query_dict.encoding
+    )
+
+def canonical_url(url, denylist=None):
+    """
+    Return ``url`` with its querystring in canonical form. The fragment, if
+    any, is kept.
+    """
+    url, hash, fragment = url.partition("#")
+    path, question, querystring = url.partition("?")
+    if question:
+        querystring = canonical_querystring(QueryDict(querystring), denylist)
+        if querystring:
+            path = "%s?%s" % (path, querystring)
+    return path + hash + fragment
@@ -0,0 +1,63 @@
+from request_utils.location import (
+    build_absolute_uri, get_absolute_base, get_current_location
+)
+
+class RequestLocation(object):
+    """
+    URL data for a request, each computed when first accessed and cached
+    for the rest of the request.
+
+    The location and querystrings are recomputed when ``request.GET`` or
+    ``request.path`` changes, as with ``get_current_location``.
+    """
+    def __init__(self, request):
+        self.request = request
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.location)
+
+    def _get_path(self):
+        return self.request.path
+
+    path = property(_get_path)
+
+    def _get_location(self):
+        return get_current_location(self.request)
+
+    location = property(_get_location)
+
+    def _get_canonical_location(self):
+        return get_current_location(self.request, canonical=True)
+
+    canonical_location = property(_get_canonical_location)
+
+    def _get_querystring(self):
+        return self.location.partition("?")[2]
+
+    querystring = property(_get_querystring)
+
+    def _get_canonical_querystring(self):
+        return self.canonical_location.partition("?")[2]
+
+    canonical_querystring = property(_get_canonical_querystring)
+
+    def _get_absolute_base(self):
+        return get_absolute_base(self.request)
+
+    absolute_base = property(_get_absolute_base)
+
+    def get_location(self, canonical=False):
+        if canonical:
+            return self.canonical_location
+        return self.location
+
+    def build_absolute_uri(self, location=None):
+        return build_absolute_uri(location, self.request)
+
+def request_location(request):
+    """
+    Adds a ``RequestLocation`` for the current request to the context as
+    ``request_location``. The ``current_location`` and ``qualified_url`` tags
+    use it when it is present.
+    """
+    return {"request_location": RequestLocation(request)}
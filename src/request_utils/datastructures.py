@@ -0,0 +1,737 @@
+import copy_reg
+import re
+from urllib import unquote
+
+from django.http import QueryDict, str_to_unicode
+from django.utils.datastructures import MultiValueDict, MultiValueDictKeyError
+from django.utils.encoding import force_unicode
+
+from request_utils.encoding import urlencode
+
+class BaseQueryDict(MultiValueDict):
+    """
+    The ``QueryDict`` API, built on top of ``iterkeys`` and ``_get_list``.
+
+    Subclasses keep their contents in their own attributes and leave the
+    dictionary they inherit empty. Being ``MultiValueDict`` instances, they
+    work with form widgets taking several values, such as ``SelectMultiple``.
+
+    Mutable subclasses provide ``setlist``, ``__delitem__`` and ``clear``;
+    the other methods changing the contents are built on top of them.
+    Immutable subclasses set ``_mutable`` to ``False`` instead.
+    """
+    _mutable = True
+
+    def __repr__(self):
+        return "<%s: %r>" % (self.__class__.__name__, dict(self.lists()))
+
+    def __eq__(self, other):
+        if not isinstance(other, MultiValueDict):
+            return NotImplemented
+        return dict(self.lists()) == dict(other.lists())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def _to_unicode(self, value):
+        return str_to_unicode(value, self.encoding)
+
+    def _get_list(self, key):
+        """
+        Return the list of values for ``key``, raising ``KeyError`` if the
+        key is not present.
+        """
+        raise NotImplementedError
+
+    #
+    # Read access
+    #
+
+    def __contains__(self, key):
+        try:
+            self._get_list(key)
+        except KeyError:
+            return False
+        return True
+
+    def has_key(self, key):
+        return key in self
+
+    def __getitem__(self, key):
+        try:
+            list_ = self._get_list(key)
+        except KeyError:
+            raise MultiValueDictKeyError("Key %r not found in %r" % (key, self))
+        try:
+            return list_[-1]
+        except IndexError:
+            return []
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        if value == []:
+            return default
+        return value
+
+    def getlist(self, key):
+        try:
+            return self._get_list(key)
+        except KeyError:
+            return []
+
+    def iterkeys(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def iterlists(self):
+        for key in self.iterkeys():
+            yield key, self._get_list(key)
+
+    def lists(self):
+        return list(self.iterlists())
+
+    def iteritems(self):
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for key in self.iterkeys():
+            yield self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    #
+    # Write access
+    #
+
+    def _assert_mutable(self):
+        if not self._mutable:
+            raise AttributeError(
+                "This %s instance is immutable" % self.__class__.__name__
+            )
+
+    def setlist(self, key, list_):
+        self._assert_mutable()
+        raise NotImplementedError
+
+    def __delitem__(self, key):
+        self._assert_mutable()
+        raise NotImplementedError
+
+    def clear(self):
+        self._assert_mutable()
+        raise NotImplementedError
+
+    def __setitem__(self, key, value):
+        self._assert_mutable()
+        self.setlist(key, [value])
+
+    def appendlist(self, key, value):
+        self._assert_mutable()
+        key = self._to_unicode(key)
+        self.setlist(key, self.getlist(key) + [value])
+
+    def setlistdefault(self, key, default_list=()):
+        self._assert_mutable()
+        if key not in self:
+            self.setlist(key, default_list)
+        return self.getlist(key)
+
+    def setdefault(self, key, default=None):
+        self._assert_mutable()
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        self._assert_mutable()
+        try:
+            list_ = self._get_list(key)
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        del self[key]
+        return list_
+
+    def popitem(self):
+        self._assert_mutable()
+        for key in self.iterkeys():
+            return key, self.pop(key)
+        raise KeyError("popitem(): %s is empty" % self.__class__.__name__)
+
+    def update(self, other_dict):
+        self._assert_mutable()
+        if hasattr(other_dict, "lists"):
+            for key, value_list in other_dict.lists():
+                for value in value_list:
+                    self.appendlist(key, value)
+        else:
+            for key, value in other_dict.items():
+                self.appendlist(key, value)
+
+    #
+    # Copying and conversion
+    #
+
+    def copy(self):
+        """
+        Return a new, mutable ``QueryDict`` with the same contents, as
+        ``QueryDict.copy`` does.
+        """
+        return self.to_query_dict()
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        # Pickle the attributes only, as the inherited dictionary is empty.
+        return (copy_reg.__newobj__, (self.__class__,), self.__getstate__())
+
+    def __getstate__(self):
+        state = dict(getattr(self, "__dict__", {}))
+        for name in getattr(self.__class__, "__slots__", ()):
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    def to_query_dict(self):
+        """
+        Return a new, mutable ``QueryDict`` with the same contents.
+        """
+        result = QueryDict("", mutable=True, encoding=self.encoding)
+        for key, list_ in self.iterlists():
+            result.setlist(key, list_[:])
+        return result
+
+    def urlencode(self, safe=None):
+        """
+        Returns an encoded string of all query string arguments, as
+        ``QueryDict.urlencode`` does.
+        """
+        return urlencode(self, safe)
+
+class QueryDictOverlay(BaseQueryDict):
+    """
+    A mutable, copy-on-write view of a ``QueryDict``.
+
+    The base ``QueryDict`` is shared rather than copied; only the keys that
+    are changed through the overlay are recorded. The base is never modified.
+    Keys keep the order of the base, with newly added keys following in the
+    order they were added.
+
+    The overlay supports the ``QueryDict`` API used by templates and the
+    request_utils tags, and may be turned into a real ``QueryDict`` with
+    ``to_query_dict``.
+    """
+    def __init__(self, base):
+        self.base = base
+        # Maps a key to its replacement list of values, or ``None`` when the
+        # key has been deleted from the base.
+        self._changes = {}
+        # Keys that are not present in the base, in insertion order.
+        self._added = []
+
+    def _get_encoding(self):
+        return self.base.encoding
+
+    encoding = property(_get_encoding)
+
+    def _get_list(self, key):
+        """
+        Return the list of values for ``key``, raising ``KeyError`` if the
+        key is not present. Lists of the base are copied, so that modifying
+        the result never modifies the base.
+        """
+        if key in self._changes:
+            list_ = self._changes[key]
+            if list_ is None:
+                raise KeyError(key)
+            return list_
+        if key in self.base:
+            return list(self.base.getlist(key))
+        raise KeyError(key)
+
+    #
+    # Read access
+    #
+
+    def __contains__(self, key):
+        if key in self._changes:
+            return self._changes[key] is not None
+        return key in self.base
+
+    def iterkeys(self):
+        changes = self._changes
+        for key in self.base:
+            if key not in changes or changes[key] is not None:
+                yield key
+        for key in self._added:
+            yield key
+
+    #
+    # Write access
+    #
+
+    def setlist(self, key, list_):
+        key = self._to_unicode(key)
+        if key not in self.base and key not in self._changes:
+            self._added.append(key)
+        self._changes[key] = [self._to_unicode(value) for value in list_]
+
+    def setlistdefault(self, key, default_list=()):
+        if key not in self:
+            self.setlist(key, default_list)
+        elif key not in self._changes:
+            self._changes[key] = self._get_list(key)
+        return self._changes[key]
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.base:
+            self._changes[key] = None
+        else:
+            del self._changes[key]
+            self._added.remove(key)
+
+    def clear(self):
+        self._changes = dict.fromkeys(self.base)
+        self._added = []
+
+    #
+    # Copying and conversion
+    #
+
+    def copy(self):
+        """
+        Return a new overlay of the same base with a copy of the changes.
+        """
+        result = self.__class__(self.base)
+        for key, list_ in self._changes.iteritems():
+            result._changes[key] = list_[:] if list_ is not None else None
+        result._added = self._added[:]
+        return result
+
+def copy_query_dict(query_dict):
+    """
+    Return a mutable copy of ``query_dict``.
+
+    Immutable ``QueryDict`` objects, such as ``request.GET``, are shared
+    through a ``QueryDictOverlay`` instead of being copied. Anything else is
+    copied with its own ``copy`` method.
+    """
+    if isinstance(query_dict, QueryDictOverlay):
+        return query_dict.copy()
+    if getattr(query_dict, "_mutable", True) is False:
+        return QueryDictOverlay(query_dict)
+    return query_dict.copy()
+
+class FrozenQueryDict(BaseQueryDict):
+    """
+    An immutable and hashable ``QueryDict``.
+
+    Keys are kept in sorted order, and the values of each key in the order
+    they were given, so that equal frozen dicts have the same canonical
+    encoding and hash, whatever order their source was in. The encoding and
+    hash are computed once, on first use.
+
+    Frozen dicts are derived from each other with ``with_list``,
+    ``with_appended``, ``without`` and ``updated``. Derived dicts share the
+    value tuples of the dict they derive from. ``copy`` returns a mutable
+    ``QueryDictOverlay`` for use with the request_utils tags.
+    """
+    _mutable = False
+
+    def __init__(self, lists=(), encoding=None):
+        if encoding is None:
+            from django.conf import settings
+            encoding = settings.DEFAULT_CHARSET
+        self.encoding = encoding
+        data = {}
+        for key, values in lists:
+            key = str_to_unicode(key, encoding)
+            values = tuple([str_to_unicode(value, encoding) for value in values])
+            data[key] = data.get(key, ()) + values
+        self._set_data(data)
+
+    def _set_data(self, data):
+        self._data = data
+        self._keys = tuple(sorted(data))
+        self._hash = None
+        self._urlencoded = None
+
+    def _derive(self, data):
+        result = self.__class__.__new__(self.__class__)
+        result.encoding = self.encoding
+        result._set_data(data)
+        return result
+
+    @classmethod
+    def from_query_dict(cls, query_dict):
+        """
+        Return a ``FrozenQueryDict`` with the contents of ``query_dict``.
+        """
+        if isinstance(query_dict, cls):
+            return query_dict
+        if hasattr(query_dict, "lists"):
+            lists = query_dict.lists()
+        else:
+            lists = [(key, [value]) for key, value in query_dict.items()]
+        return cls(lists, getattr(query_dict, "encoding", None))
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.urlencode())
+
+    #
+    # Comparison and hashing
+    #
+
+    def canonical(self):
+        """
+        Return a tuple of ``(key, values)`` pairs in canonical order.
+        """
+        data = self._data
+        return tuple([(key, data[key]) for key in self._keys])
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.canonical())
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenQueryDict):
+            return NotImplemented
+        return self is other or (
+            hash(self) == hash(other) and self._data == other._data
+        )
+
+    #
+    # Read access
+    #
+
+    def _get_list(self, key):
+        return list(self._data[key])
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def iterkeys(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def urlencode(self, safe=None):
+        """
+        Returns the canonical encoded query string, with keys in sorted
+        order.
+        """
+        if safe:
+            return urlencode(self, safe)
+        if self._urlencoded is None:
+            self._urlencoded = urlencode(self)
+        return self._urlencoded
+
+    #
+    # Deriving new dicts
+    #
+
+    def with_list(self, key, values):
+        """
+        Return a frozen dict with the values for ``key`` replaced.
+        """
+        data = self._data.copy()
+        data[str_to_unicode(key, self.encoding)] = tuple([
+            str_to_unicode(value, self.encoding) for value in values
+        ])
+        return self._derive(data)
+
+    def with_appended(self, key, *values):
+        """
+        Return a frozen dict with ``values`` appended to those for ``key``.
+        """
+        key = str_to_unicode(key, self.encoding)
+        return self.with_list(key, self._data.get(key, ()) + values)
+
+    def without(self, *keys):
+        """
+        Return a frozen dict without the given keys.
+        """
+        data = self._data.copy()
+        for key in keys:
+            data.pop(key, None)
+        return self._derive(data)
+
+    def updated(self, other_dict):
+        """
+        Return a frozen dict with the values of ``other_dict`` appended, as
+        ``QueryDict.update`` would.
+        """
+        if hasattr(other_dict, "lists"):
+            lists = other_dict.lists()
+        else:
+            lists = [(key, [value]) for key, value in other_dict.items()]
+        data = self._data.copy()
+        encoding = self.encoding
+        for key, values in lists:
+            key = str_to_unicode(key, encoding)
+            data[key] = data.get(key, ()) + tuple([
+                str_to_unicode(value, encoding) for value in values
+            ])
+        return self._derive(data)
+
+    #
+    # Copying and conversion
+    #
+
+    def copy(self):
+        """
+        Return a mutable, copy-on-write ``QueryDictOverlay`` of this dict.
+        """
+        return QueryDictOverlay(self)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+def freeze_query_dict(query_dict):
+    """
+    Return a ``FrozenQueryDict`` with the contents of ``query_dict``.
+    """
+    return FrozenQueryDict.from_query_dict(query_dict)
+
+class ScratchQueryDict(BaseQueryDict):
+    """
+    A lightweight, mutable ``QueryDict`` for building querystrings from
+    scratch.
+
+    Instances only hold a list of ``[key, values]`` pairs in insertion order,
+    so they are cheap to create: no querystring is parsed and the encoding is
+    only looked up when first needed. Keys are looked up with a linear scan,
+    which suits the handful of keys a querystring built in a template has.
+
+    The API used by templates and the request_utils tags is supported, and
+    ``urlencode`` gives the same result as ``QueryDict.urlencode``. A real
+    ``QueryDict`` is returned by ``to_query_dict``.
+    """
+    __slots__ = ("_pairs", "_encoding")
+
+    def __init__(self, encoding=None):
+        self._pairs = []
+        self._encoding = encoding
+
+    def _get_encoding(self):
+        if self._encoding is None:
+            from django.conf import settings
+            self._encoding = settings.DEFAULT_CHARSET
+        return self._encoding
+
+    def _set_encoding(self, value):
+        self._encoding = value
+
+    encoding = property(_get_encoding, _set_encoding)
+
+    def _find(self, key):
+        """
+        Return the ``[key, values]`` pair for ``key``, or ``None``.
+        """
+        for pair in self._pairs:
+            if pair[0] == key:
+                return pair
+        return None
+
+    def _get_list(self, key):
+        pair = self._find(key)
+        if pair is None:
+            raise KeyError(key)
+        return pair[1]
+
+    #
+    # Read access
+    #
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def iterkeys(self):
+        for key, _ in self._pairs:
+            yield key
+
+    def __len__(self):
+        return len(self._pairs)
+
+    #
+    # Write access
+    #
+
+    def setlist(self, key, list_):
+        key = self._to_unicode(key)
+        list_ = [self._to_unicode(value) for value in list_]
+        pair = self._find(key)
+        if pair is None:
+            self._pairs.append([key, list_])
+        else:
+            pair[1] = list_
+
+    def appendlist(self, key, value):
+        key = self._to_unicode(key)
+        value = self._to_unicode(value)
+        pair = self._find(key)
+        if pair is None:
+            self._pairs.append([key, [value]])
+        else:
+            pair[1].append(value)
+
+    def __delitem__(self, key):
+        for index, pair in enumerate(self._pairs):
+            if pair[0] == key:
+                del self._pairs[index]
+                return
+        raise KeyError(key)
+
+    def clear(self):
+        del self._pairs[:]
+
+    #
+    # Copying and conversion
+    #
+
+    def copy(self):
+        """
+        Return a new ``ScratchQueryDict`` with a copy of the contents.
+        """
+        result = self.__class__(self._encoding)
+        result._pairs = [[key, list_[:]] for key, list_ in self._pairs]
+        return result
+
+query_argument_separator_re = re.compile(r"[&;]")
+
+class LazyQueryDict(BaseQueryDict):
+    """
+    An immutable ``QueryDict`` that parses its query string lazily.
+
+    The query string is only split into arguments when first used, and the
+    values of a key are only decoded when that key is accessed. Arguments are
+    decoded exactly as ``QueryDict`` decodes them.
+
+    At most ``max_keys`` arguments are parsed, the rest of the query string
+    being ignored, and values longer than ``max_value_length`` encoded
+    characters are left out. Either limit may be ``None`` for no limit.
+    """
+    _mutable = False
+
+    def __init__(self, query_string, encoding=None, max_keys=None,
+                 max_value_length=None):
+        if not encoding:
+            from django.conf import settings
+            encoding = settings.DEFAULT_CHARSET
+        self.query_string = query_string or ""
+        self.encoding = encoding
+        self.max_keys = max_keys
+        self.max_value_length = max_value_length
+        # Maps each key to its list of encoded values, and lists the keys in
+        # the order they first appear, once the query string is split.
+        self._encoded = None
+        self._keys = None
+        # Maps each key accessed so far to its list of decoded values.
+        self._decoded = {}
+
+    def __repr__(self):
+        return "<%s: %r>" % (self.__class__.__name__, self.query_string)
+
+    def _decode(self, value):
+        return force_unicode(
+            unquote(value.replace("+", " ")), self.encoding, errors="replace"
+        )
+
+    def _split(self):
+        """
+        Split the query string into arguments, decoding only their keys.
+        """
+        encoded = {}
+        keys = []
+        if self.max_keys is None:
+            arguments = query_argument_separator_re.split(self.query_string)
+        else:
+            arguments = query_argument_separator_re.split(
+                self.query_string, self.max_keys
+            )[:self.max_keys]
+        max_value_length = self.max_value_length
+        for argument in arguments:
+            if not argument:
+                continue
+            key, _, value = argument.partition("=")
+            if max_value_length is not None and len(value) > max_value_length:
+                continue
+            key = self._decode(key)
+            if key in encoded:
+                encoded[key].append(value)
+            else:
+                encoded[key] = [value]
+                keys.append(key)
+        self._encoded = encoded
+        self._keys = keys
+
+    def _get_list(self, key):
+        """
+        Return the decoded list of values for ``key``, raising ``KeyError``
+        if the key is not present.
+        """
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        if self._encoded is None:
+            self._split()
+        list_ = [self._decode(value) for value in self._encoded[key]]
+        self._decoded[key] = list_
+        return list_
+
+    #
+    # Read access
+    #
+
+    def __contains__(self, key):
+        if self._encoded is None:
+            self._split()
+        return key in self._encoded
+
+    def iterkeys(self):
+        if self._keys is None:
+            self._split()
+        return iter(self._keys)
+
+    #
+    # Copying and conversion
+    #
+
+    def __copy__(self):
+        return self
@@ -0,0 +1,202 @@
+from cStringIO import StringIO
+from urllib import quote, quote_plus
+
+from django.conf import settings
+from django.utils.encoding import smart_str
+
+from request_utils.cache import (
+    LRUCache, matches_snapshot, snapshot_query_dict
+)
+
+class QueryStringWriter(object):
+    """
+    Encodes query string arguments straight into a single buffer, exactly as
+    ``QueryDict.urlencode`` would encode them.
+
+    When a ``key_prefixes`` dictionary is given, the encoded form of each key
+    is computed once and kept in it, so that it may be shared between
+    writers. Otherwise keys are encoded each time they are written, so that
+    a single writer holds on to nothing but its buffer.
+    """
+    def __init__(self, encoding, safe=None, key_prefixes=None):
+        self.encoding = encoding
+        if safe:
+            self.quote = lambda value: quote(value, safe)
+        else:
+            self.quote = quote_plus
+        self.key_prefixes = key_prefixes
+        self.buffer = StringIO()
+        self.empty = True
+
+    def encode_key(self, key):
+        """
+        Return the encoded ``key=`` prefix for ``key``.
+        """
+        if self.key_prefixes is None:
+            return self.quote(smart_str(key, self.encoding)) + "="
+        try:
+            return self.key_prefixes[key]
+        except KeyError:
+            prefix = self.quote(smart_str(key, self.encoding)) + "="
+            self.key_prefixes[key] = prefix
+            return prefix
+
+    def write_list(self, key, values):
+        """
+        Write a ``key=value`` argument for each of ``values``.
+        """
+        if not values:
+            return
+        prefix = self.encode_key(key)
+        write = self.buffer.write
+        quote = self.quote
+        encoding = self.encoding
+        for value in values:
+            if self.empty:
+                self.empty = False
+            else:
+                write("&")
+            write(prefix)
+            write(quote(smart_str(value, encoding)))
+
+    def write(self, key, value):
+        self.write_list(key, [value])
+
+    def write_lists(self, lists):
+        """
+        Write every ``(key, values)`` pair of ``lists``.
+        """
+        for key, values in lists:
+            self.write_list(key, values)
+
+    def write_encoded(self, querystring):
+        """
+        Write an already encoded query string.
+        """
+        if not querystring:
+            return
+        if self.empty:
+            self.empty = False
+        else:
+            self.buffer.write("&")
+        self.buffer.write(querystring)
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+def urlencode(query_dict, safe=None):
+    """
+    Return the encoded query string of ``query_dict``, as
+    ``query_dict.urlencode(safe)`` would, without building a list of every
+    encoded argument first.
+    """
+    writer = QueryStringWriter(query_dict.encoding, safe)
+    if hasattr(query_dict, "iterlists"):
+        writer.write_lists(query_dict.iterlists())
+    else:
+        writer.write_lists(query_dict.lists())
+    return writer.getvalue()
+
+class QueryStringTemplate(object):
+    """
+    The encoded query string of a ``QueryDict`` with slots for a set of
+    ``keys`` whose values vary.
+
+    Everything but the varied keys is encoded once, when the template is
+    created, so that rendering it only encodes the values that change.
+    """
+    def __init__(self, query_dict, keys, safe=None):
+        self.encoding = query_dict.encoding
+        self.safe = safe
+        self.key_prefixes = {}
+        self.keys = frozenset(keys)
+        # A list of (encoded chunk, key) pairs, where the key is that of the
+        # slot following the chunk, or None for the final chunk.
+        self.parts = []
+        # The original values of the varied keys that are in the QueryDict.
+        self.values = {}
+        writer = self.get_writer()
+        for key, list_ in query_dict.lists():
+            if key in self.keys:
+                self.parts.append((writer.getvalue(), key))
+                self.values[key] = list_[:]
+                writer = self.get_writer()
+            else:
+                writer.write_list(key, list_)
+        self.parts.append((writer.getvalue(), None))
+
+    def get_writer(self):
+        return QueryStringWriter(self.encoding, self.safe, self.key_prefixes)
+
+    def render(self, changes):
+        """
+        Return the encoded query string with ``changes`` applied.
+
+        ``changes`` is a sequence of ``(key, values)`` pairs, as taken by
+        ``urlencode_with_changes``. Varied keys without a change keep their
+        original values.
+        """
+        writer = self.get_writer()
+        pending = dict(changes)
+        for chunk, key in self.parts:
+            writer.write_encoded(chunk)
+            if key is not None:
+                list_ = pending.pop(key, self.values[key])
+                if list_ is not None:
+                    writer.write_list(key, list_)
+        for key, _ in changes:
+            list_ = pending.pop(key, None)
+            if list_ is not None:
+                writer.write_list(key, list_)
+        return writer.getvalue()
+
+class QueryStringTemplateCache(object):
+    """
+    A bounded cache of ``QueryStringTemplate`` objects keyed on the
+    ``QueryDict`` and the set of varied keys.
+
+    Cached templates are only reused while the ``QueryDict`` keeps the
+    contents it had when the template was created.
+    """
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = getattr(
+                settings, "REQUEST_UTILS_QUERYSTRING_CACHE_SIZE", 32
+            )
+        self.templates = LRUCache(max_size)
+
+    def get_template(self, query_dict, keys, safe=None):
+        keys = frozenset(keys)
+        cache_key = (id(query_dict), keys, safe)
+        cached = self.templates.get(cache_key)
+        if cached is not None:
+            cached_query_dict, snapshot, querystring_template = cached
+            if (cached_query_dict is query_dict
+                    and matches_snapshot(query_dict, snapshot)):
+                return querystring_template
+        querystring_template = QueryStringTemplate(query_dict, keys, safe)
+        self.templates[cache_key] = (
+            query_dict, snapshot_query_dict(query_dict), querystring_template
+        )
+        return querystring_template
+
+def urlencode_with_changes(query_dict, changes, safe=None, cache=None):
+    """
+    Return the encoded query string of ``query_dict`` with ``changes``
+    applied, without modifying or copying ``query_dict``.
+
+    ``changes`` is a sequence of ``(key, values)`` pairs, where ``values`` is
+    the list of values that should replace the existing values for ``key``,
+    or ``None`` when the key should be left out. Later pairs win over earlier
+    ones for the same key. Replaced keys keep their position; keys that are
+    not in ``query_dict`` are encoded last, in the order they were given.
+
+    If a ``QueryStringTemplateCache`` is given as ``cache``, the encoded
+    parts of ``query_dict`` that are not changed are taken from it.
+    """
+    keys = [key for key, _ in changes]
+    if cache is None:
+        querystring_template = QueryStringTemplate(query_dict, keys, safe)
+    else:
+        querystring_template = cache.get_template(query_dict, keys, safe)
+    return querystring_template.render(changes)
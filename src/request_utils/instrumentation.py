@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+
+from django import template
+
+logger = logging.getLogger("request_utils.instrumentation")
+
+_local = threading.local()
+
+# Maps instrumented node classes to their original render methods.
+_original_renders = {}
+
+# The original ``Template._render`` method, while it is wrapped.
+_original_template_render = None
+
+class TagStats(object):
+    """
+    Render statistics for one tag in one template.
+    """
+    def __init__(self, tag_name, origin):
+        self.tag_name = tag_name
+        self.origin = origin
+        self.calls = 0
+        self.seconds = 0.0
+        self.query_dict_keys = 0
+        self.max_query_dict_keys = 0
+
+    def as_dict(self):
+        return {
+            "tag": self.tag_name,
+            "origin": self.origin,
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "query_dict_keys": self.query_dict_keys,
+            "max_query_dict_keys": self.max_query_dict_keys,
+        }
+
+class StatsCollector(object):
+    """
+    Collects ``TagStats`` keyed on tag name and template origin.
+    """
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, tag_name, origin, seconds, query_dict_keys=None):
+        key = (tag_name, origin)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = TagStats(tag_name, origin)
+        stats.calls += 1
+        stats.seconds += seconds
+        if query_dict_keys is not None:
+            stats.query_dict_keys += query_dict_keys
+            if query_dict_keys > stats.max_query_dict_keys:
+                stats.max_query_dict_keys = query_dict_keys
+
+    def summary(self):
+        """
+        Return the statistics as a list of dictionaries, most expensive
+        first.
+        """
+        return [
+            stats.as_dict() for stats in
+            sorted(self.stats.values(), key=lambda stats: -stats.seconds)
+        ]
+
+    def log(self, level=logging.DEBUG):
+        """
+        Log one line per tag and template to the
+        ``request_utils.instrumentation`` logger.
+        """
+        for stats in self.summary():
+            logger.log(
+                level,
+                "%(tag)s in %(origin)s: %(calls)d calls, %(seconds).6fs,"
+                " at most %(max_query_dict_keys)d QueryDict keys", stats
+            )
+
+def start_collecting():
+    """
+    Start collecting statistics in the current thread, returning the new
+    ``StatsCollector``.
+    """
+    collector = _local.collector = StatsCollector()
+    return collector
+
+def stop_collecting():
+    """
+    Stop collecting statistics in the current thread, returning the
+    ``StatsCollector`` that was in use, if any.
+    """
+    collector = getattr(_local, "collector", None)
+    _local.collector = None
+    return collector
+
+def get_collector():
+    return getattr(_local, "collector", None)
+
+def get_template_names():
+    """
+    Return the stack of the names of the templates being rendered in the
+    current thread, innermost last.
+    """
+    names = getattr(_local, "template_names", None)
+    if names is None:
+        names = _local.template_names = []
+    return names
+
+def get_origin(node):
+    """
+    Return the name of the template ``node`` was compiled from when
+    ``TEMPLATE_DEBUG`` is enabled, and otherwise the name of the template
+    being rendered.
+    """
+    source = getattr(node, "source", None)
+    if source is not None:
+        name = getattr(source[0], "name", None)
+        if name:
+            return name
+    names = get_template_names()
+    if names:
+        return names[-1]
+    return "<unknown>"
+
+def count_query_dict_keys(node, context):
+    """
+    Return the number of keys of the ``QueryDict`` the given node works on,
+    or ``None`` when it has none or it cannot be resolved.
+    """
+    resolver = getattr(node, "query_dict", None) or getattr(node, "var", None)
+    if resolver is None:
+        return None
+    try:
+        return len(resolver.resolve(context))
+    except (template.VariableDoesNotExist, TypeError):
+        return None
+
+def make_instrumented_render(render, tag_name):
+    def instrumented_render(self, context):
+        collector = getattr(_local, "collector", None)
+        if collector is None:
+            return render(self, context)
+        start = time.time()
+        try:
+            return render(self, context)
+        finally:
+            seconds = time.time() - start
+            collector.record(
+                tag_name, get_origin(self), seconds,
+                count_query_dict_keys(self, context),
+            )
+    instrumented_render.__name__ = render.__name__
+    instrumented_render.__doc__ = render.__doc__
+    return instrumented_render
+
+def make_instrumented_template_render(render):
+    def instrumented_render(self, context):
+        if getattr(_local, "collector", None) is None:
+            return render(self, context)
+        names = get_template_names()
+        names.append(self.name)
+        try:
+            return render(self, context)
+        finally:
+            names.pop()
+    instrumented_render.__name__ = render.__name__
+    instrumented_render.__doc__ = render.__doc__
+    return instrumented_render
+
+def install(node_classes):
+    """
+    Wrap the ``render`` method of each node class in ``node_classes``, a
+    mapping of node classes to tag names, to record statistics while a
+    collector is active.
+
+    ``Template._render``, which renders templates and the templates they
+    extend, is wrapped as well, to know the name of the template being
+    rendered when ``TEMPLATE_DEBUG`` is disabled.
+    """
+    global _original_template_render
+    if _original_template_render is None:
+        _original_template_render = template.Template.__dict__["_render"]
+        template.Template._render = make_instrumented_template_render(
+            _original_template_render
+        )
+    for node_class, tag_name in node_classes.items():
+        if node_class in _original_renders:
+            continue
+        render = node_class.__dict__["render"]
+        _original_renders[node_class] = render
+        node_class.render = make_instrumented_render(render, tag_name)
+
+def uninstall():
+    """
+    Restore the original ``render`` methods of all instrumented node
+    classes.
+    """
+    global _original_template_render
+    for node_class, render in _original_renders.items():
+        node_class.render = render
+    _original_renders.clear()
+    if _original_template_render is not None:
+        template.Template._render = _original_template_render
+        _original_template_render = None
@@ -0,0 +1,27 @@
+from request_utils import query
+
+GLOBALS = {
+    "with_params": query.with_params,
+    "without": query.without,
+    "clone_query_dict": query.clone_query_dict,
+    "freeze_query_dict": query.freeze_query_dict,
+    "new_query_dict": query.new_query_dict,
+    "qualified_url": query.qualified_url,
+    "qualified_urls": query.qualified_urls,
+    "current_location": query.current_location,
+    "page_links": query.page_links,
+    "facet_links": query.facet_links,
+    "sort_links": query.sort_links,
+}
+
+def install(environment):
+    """
+    Register the request_utils helpers as globals of the given Jinja2
+    ``Environment``, e.g.::
+
+        <a href="{{ with_params(request.GET, page=2).without('sort').url() }}">
+
+    Jinja2 itself is not imported, so this module may be imported whether
+    or not it is installed.
+    """
+    environment.globals.update(GLOBALS)
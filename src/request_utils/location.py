@@ -0,0 +1,128 @@
+import re
+from urlparse import urljoin
+
+from django.conf import settings
+from django.utils.encoding import iri_to_uri, smart_str
+from django.utils.hashcompat import md5_constructor
+
+from request_utils.cache import matches_snapshot, snapshot_query_dict
+from request_utils.canonical import canonical_querystring
+from request_utils.encoding import QueryStringWriter, urlencode
+
+LOCATION_CACHE_ATTR = "_request_utils_location"
+CANONICAL_LOCATION_CACHE_ATTR = "_request_utils_canonical_location"
+BASE_CACHE_ATTR = "_request_utils_base"
+
+absolute_http_url_re = re.compile(r"^https?://", re.I)
+
+def get_current_location(request, canonical=False):
+    """
+    Return the path and querystring of ``request``. With ``canonical``, the
+    querystring is in the canonical form given by
+    ``request_utils.canonical.canonical_querystring``.
+
+    The result is cached on the request. The cache is keyed on the identity of
+    ``request.GET`` and on its contents, so it is recomputed when
+    ``request.GET`` is replaced or mutated, or when ``request.path`` changes.
+    """
+    query_dict = request.GET
+    path = request.path
+    if canonical:
+        cache_attr = CANONICAL_LOCATION_CACHE_ATTR
+    else:
+        cache_attr = LOCATION_CACHE_ATTR
+    cached = getattr(request, cache_attr, None)
+    if cached is not None:
+        cached_query_dict, cached_path, snapshot, location = cached
+        if (cached_query_dict is query_dict and cached_path == path
+                and matches_snapshot(query_dict, snapshot)):
+            return location
+    if canonical:
+        querystring = canonical_querystring(query_dict)
+    else:
+        querystring = urlencode(query_dict)
+    if querystring:
+        location = u"%s?%s" % (path, querystring)
+    else:
+        location = path
+    setattr(request, cache_attr,
+            (query_dict, path, snapshot_query_dict(query_dict), location))
+    return location
+
+def get_cache_key(request, key_prefix="request_utils.location"):
+    """
+    Return a cache key for the canonical location of ``request``, for use in
+    middleware and views caching pages by URL. Equivalent querystrings give
+    the same key.
+    """
+    location = get_current_location(request, canonical=True)
+    return "%s.%s" % (
+        key_prefix, md5_constructor(location.encode("utf-8")).hexdigest()
+    )
+
+def get_query_fingerprint(path, query_dict, keys):
+    """
+    Return a fingerprint of ``path`` and of the values of ``keys`` in
+    ``query_dict``, ignoring any other key. The keys are taken in sorted
+    order, so neither the order of ``keys`` nor that of the querystring
+    matter, while the values of each key keep their order.
+    """
+    writer = QueryStringWriter(query_dict.encoding)
+    for key in sorted(set(keys)):
+        writer.write_list(key, query_dict.getlist(key))
+    return md5_constructor(
+        "%s?%s" % (smart_str(path), writer.getvalue())
+    ).hexdigest()
+
+def get_absolute_base(request=None):
+    """
+    Return the scheme and host part of absolute URLs, e.g.
+    ``"https://example.com"``.
+
+    If the ``REQUEST_UTILS_BASE_URL`` setting is set, it is used as is and
+    the request is not inspected at all. Otherwise the base is computed from
+    ``request`` once and cached on it.
+    """
+    base_url = getattr(settings, "REQUEST_UTILS_BASE_URL", None)
+    if base_url:
+        return base_url.rstrip("/")
+    base = getattr(request, BASE_CACHE_ATTR, None)
+    if base is None:
+        base = "%s://%s" % (
+            request.is_secure() and "https" or "http", request.get_host()
+        )
+        setattr(request, BASE_CACHE_ATTR, base)
+    return base
+
+def build_absolute_uri(location, request=None):
+    """
+    Return ``location`` as an absolute URI, like
+    ``request.build_absolute_uri``, using the cached base from
+    ``get_absolute_base``.
+
+    Absolute paths are appended to the base directly; only relative
+    locations go through ``urljoin``. ``request`` may be ``None`` when the
+    ``REQUEST_UTILS_BASE_URL`` setting is set, in which case relative
+    locations are resolved against the root path.
+    """
+    if not location and request is not None:
+        location = request.get_full_path()
+    if absolute_http_url_re.match(location):
+        return iri_to_uri(location)
+    base = get_absolute_base(request)
+    if location.startswith("/") and not location.startswith("//"):
+        return iri_to_uri(base + location)
+    path = request is not None and request.path or "/"
+    return iri_to_uri(urljoin(base + path, location))
+
+def iter_absolute_uris(locations, request=None):
+    """
+    Yield each of ``locations`` as an absolute URI, as
+    ``build_absolute_uri`` would, computing the base only once.
+    """
+    base = get_absolute_base(request)
+    for location in locations:
+        if location.startswith("/") and not location.startswith("//"):
+            yield iri_to_uri(base + location)
+        else:
+            yield build_absolute_uri(location, request)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from request_utils.warmup import warm_templates
+
+class Command(BaseCommand):
+    args = "[template_name ...]"
+    help = (
+        "Compiles the given templates, by default those listed in the"
+        " REQUEST_UTILS_WARMUP_TEMPLATES setting, and reports their compile"
+        " times and errors."
+    )
+
+    def handle(self, *template_names, **options):
+        verbosity = int(options.get("verbosity", 1))
+        results = warm_templates(template_names or None)
+        failed = 0
+        for name, seconds, error in results:
+            if error is not None:
+                failed += 1
+                self.stderr.write("%s: %s: %s\n" % (
+                    name, error.__class__.__name__, error
+                ))
+            elif verbosity >= 2:
+                self.stdout.write("%s: %.1f ms\n" % (name, seconds * 1e3))
+        if verbosity >= 1:
+            self.stdout.write("Compiled %d of %d templates in %.1f ms\n" % (
+                len(results) - failed, len(results),
+                sum([seconds for _, seconds, _ in results]) * 1e3
+            ))
+        if failed:
+            raise CommandError("%d templates failed to compile" % failed)
@@ -0,0 +1,42 @@
+from django.conf import settings
+
+from request_utils import instrumentation
+from request_utils.datastructures import LazyQueryDict
+
+class InstrumentationMiddleware(object):
+    """
+    Collects render statistics of the request_utils tags for each request.
+
+    The ``StatsCollector`` is available as ``request.request_utils_stats``
+    and is logged to the ``request_utils.instrumentation`` logger when the
+    response is returned. Statistics are only recorded when the
+    ``REQUEST_UTILS_INSTRUMENTATION`` setting is enabled.
+    """
+    def process_request(self, request):
+        request.request_utils_stats = instrumentation.start_collecting()
+
+    def process_response(self, request, response):
+        collector = instrumentation.stop_collecting()
+        if collector is not None:
+            collector.log()
+        return response
+
+class LazyQueryDictMiddleware(object):
+    """
+    Replaces ``request.GET`` with a ``LazyQueryDict``, which only decodes the
+    values of the keys that are accessed.
+
+    The number of arguments parsed and the length of each value are limited
+    by the ``REQUEST_UTILS_QUERY_MAX_KEYS`` and
+    ``REQUEST_UTILS_QUERY_MAX_VALUE_LENGTH`` settings, 1000 and 4096 by
+    default. Either may be set to ``None`` for no limit.
+    """
+    def process_request(self, request):
+        request.GET = LazyQueryDict(
+            request.META.get("QUERY_STRING", ""),
+            encoding=getattr(request, "encoding", None),
+            max_keys=getattr(settings, "REQUEST_UTILS_QUERY_MAX_KEYS", 1000),
+            max_value_length=getattr(
+                settings, "REQUEST_UTILS_QUERY_MAX_VALUE_LENGTH", 4096
+            ),
+        )
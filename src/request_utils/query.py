@@ -0,0 +1,404 @@
+from django.utils.encoding import force_unicode
+
+from request_utils.canonical import canonical_query_dict, canonical_url
+from request_utils.datastructures import (
+    QueryDictOverlay, ScratchQueryDict, copy_query_dict,
+    freeze_query_dict as _freeze_query_dict
+)
+from request_utils.encoding import QueryStringTemplate, urlencode_with_changes
+from request_utils.location import (
+    build_absolute_uri, get_current_location, iter_absolute_uris
+)
+
+#
+# Functions mirroring the template tags
+#
+
+def append_key(query_dict, key, *values):
+    """
+    Appends the given values to the list of values for ``key`` in
+    ``query_dict``, like the ``append_key`` tag.
+    """
+    for value in values:
+        query_dict.appendlist(key, value)
+
+def replace_key(query_dict, key, *values):
+    """
+    Replaces the values for ``key`` in ``query_dict`` with the given values,
+    like the ``replace_key`` tag.
+    """
+    if key in query_dict:
+        del query_dict[key]
+    for value in values:
+        query_dict.appendlist(key, value)
+
+def delete_key(query_dict, *keys):
+    """
+    Removes the given keys from ``query_dict``, ignoring missing keys, like
+    the ``delete_key`` tag.
+    """
+    for key in keys:
+        if key in query_dict:
+            del query_dict[key]
+
+def update_query_dict(query_dict, *others):
+    """
+    Updates ``query_dict`` with the values from each of ``others``, like the
+    ``update_query_dict`` tag.
+    """
+    for other in others:
+        query_dict.update(other)
+
+def clone_query_dict(query_dict, canonical=False):
+    """
+    Returns a mutable clone of ``query_dict``, like the ``clone_query_dict``
+    tag. With ``canonical``, the clone has the canonical contents of
+    ``query_dict``.
+    """
+    if canonical:
+        return QueryDictOverlay(canonical_query_dict(query_dict))
+    return copy_query_dict(query_dict)
+
+def freeze_query_dict(query_dict, canonical=False):
+    """
+    Returns a ``FrozenQueryDict`` with the contents of ``query_dict``, like
+    the ``freeze_query_dict`` tag. With ``canonical``, its contents are
+    canonical.
+    """
+    if canonical:
+        return canonical_query_dict(query_dict)
+    return _freeze_query_dict(query_dict)
+
+def new_query_dict():
+    """
+    Returns a new, empty and mutable ``ScratchQueryDict``, like the
+    ``query_dict`` tag. Its ``to_query_dict`` method returns a real
+    ``QueryDict``.
+    """
+    return ScratchQueryDict()
+
+def qualified_url(path, request=None, canonical=False):
+    """
+    Returns ``path`` as a fully qualified URL, like the ``qualified_url``
+    tag. With ``canonical``, its querystring is in canonical form.
+    """
+    if canonical:
+        path = canonical_url(path)
+    return build_absolute_uri(path, request)
+
+def qualified_urls(paths, request=None, canonical=False):
+    """
+    Yield each of ``paths`` as a fully qualified URL, like the
+    ``qualified_urls`` tag. Objects with a ``get_absolute_url`` method may be
+    given instead of paths. With ``canonical``, querystrings are in canonical
+    form.
+
+    URLs are generated one at a time, so that the result may be streamed.
+    """
+    def iter_paths():
+        for path in paths:
+            if hasattr(path, "get_absolute_url"):
+                path = path.get_absolute_url()
+            if canonical:
+                path = canonical_url(path)
+            yield path
+    return iter_absolute_uris(iter_paths(), request)
+
+def current_location(request, canonical=False):
+    """
+    Returns the path and querystring of ``request``, like the
+    ``current_location`` tag. With ``canonical``, the querystring is in
+    canonical form.
+    """
+    return get_current_location(request, canonical)
+
+#
+# URL builder
+#
+
+class QueryBuilder(object):
+    """
+    Builds URLs from a ``QueryDict`` and a list of changes to it, without
+    copying or modifying the ``QueryDict``.
+
+    Builders are immutable: each method returns a new builder, so that a
+    builder may be shared as the base of many URLs::
+
+        base = with_params(request.GET).without("page")
+        urls = [base.with_params(sort=column).url() for column in columns]
+
+    """
+    def __init__(self, query_dict, changes=()):
+        self.query_dict = query_dict
+        # A tuple of (key, values) pairs, values being None for removed keys.
+        self.changes = tuple(changes)
+
+    def __repr__(self):
+        return "<%s: %s>" % (self.__class__.__name__, self.url())
+
+    def __unicode__(self):
+        return self.url()
+
+    def __str__(self):
+        return self.url()
+
+    def _with_changes(self, changes):
+        return self.__class__(self.query_dict, self.changes + tuple(changes))
+
+    def getlist(self, key):
+        """
+        Returns the list of values ``key`` will have in the URL.
+        """
+        for changed_key, values in reversed(self.changes):
+            if changed_key == key:
+                return list(values) if values is not None else []
+        return list(self.query_dict.getlist(key))
+
+    def with_params(self, **params):
+        """
+        Replaces the values for each keyword argument. Lists and tuples give
+        several values.
+        """
+        return self._with_changes([
+            (key, list(value) if isinstance(value, (list, tuple)) else [value])
+            for key, value in params.items()
+        ])
+
+    def with_list(self, key, values):
+        """
+        Replaces the values for ``key``, which need not be a valid keyword.
+        """
+        return self._with_changes([(key, list(values))])
+
+    def appending(self, key, *values):
+        """
+        Appends the given values to those for ``key``.
+        """
+        return self._with_changes([(key, self.getlist(key) + list(values))])
+
+    def without(self, *keys):
+        """
+        Removes the given keys.
+        """
+        return self._with_changes([(key, None) for key in keys])
+
+    def querystring(self, safe=None, cache=None):
+        """
+        Returns the encoded querystring. A ``QueryStringTemplateCache`` may
+        be given to reuse the encoding of unchanged keys.
+        """
+        return urlencode_with_changes(
+            self.query_dict, self.changes, safe=safe, cache=cache
+        )
+
+    def url(self, path=None, cache=None):
+        """
+        Returns the URL. Without a ``path``, this is the relative URL made of
+        ``?`` and the querystring, as rendered by the ``modified_url`` tag.
+        """
+        querystring = self.querystring(cache=cache)
+        if path is None:
+            return "?" + querystring
+        if not querystring:
+            return path
+        return u"%s?%s" % (path, querystring)
+
+    def absolute_url(self, path, request=None):
+        """
+        Returns the fully qualified URL for ``path`` with the querystring.
+        """
+        return build_absolute_uri(self.url(path), request)
+
+    def query_dict_copy(self):
+        """
+        Returns a mutable clone of the ``QueryDict`` with the changes
+        applied.
+        """
+        result = copy_query_dict(self.query_dict)
+        for key, values in self.changes:
+            if values is None:
+                delete_key(result, key)
+            else:
+                replace_key(result, key, *values)
+        return result
+
+    def frozen(self):
+        """
+        Returns a ``FrozenQueryDict`` with the changes applied.
+        """
+        return _freeze_query_dict(self.query_dict_copy())
+
+def with_params(query_dict, **params):
+    """
+    Returns a ``QueryBuilder`` for ``query_dict`` with the values for each
+    keyword argument replaced.
+    """
+    return QueryBuilder(query_dict).with_params(**params)
+
+def without(query_dict, *keys):
+    """
+    Returns a ``QueryBuilder`` for ``query_dict`` without the given keys.
+    """
+    return QueryBuilder(query_dict).without(*keys)
+
+#
+# Pagination
+#
+
+# The entry standing for a run of pages left out of ``page_links``.
+PAGE_ELLIPSIS = (None, None, False)
+
+def get_page_numbers(number, num_pages, window=5):
+    """
+    Return the page numbers to link to from page ``number``: the pages within
+    ``window`` pages of it, and the first and last pages. ``None`` stands for
+    a run of two or more pages left out between them.
+    """
+    first = max(1, number - window)
+    last = min(num_pages, number + window)
+    numbers = []
+    if first > 1:
+        numbers.append(1)
+        if first > 3:
+            numbers.append(None)
+        elif first == 3:
+            numbers.append(2)
+    numbers.extend(range(first, last + 1))
+    if last < num_pages:
+        if last < num_pages - 2:
+            numbers.append(None)
+        elif last == num_pages - 2:
+            numbers.append(num_pages - 1)
+        numbers.append(num_pages)
+    return numbers
+
+def page_links(query_dict, key, page, window=5, cache=None):
+    """
+    Return the links of a paginator for ``page``, a Django ``Page``, as a
+    list of ``(number, url, is_current)`` tuples, like the ``page_links``
+    tag. Each URL is ``query_dict`` with the values for ``key`` replaced by
+    the page number, as rendered by ``modified_url``. Runs of pages left out
+    are given as ``PAGE_ELLIPSIS``, ``(None, None, False)``.
+
+    The rest of the querystring is encoded once for every link. A
+    ``QueryStringTemplateCache`` may be given to reuse it across calls.
+    """
+    current = page.number
+    numbers = get_page_numbers(current, page.paginator.num_pages, int(window))
+    if cache is None:
+        querystring_template = QueryStringTemplate(query_dict, [key])
+    else:
+        querystring_template = cache.get_template(query_dict, [key])
+    links = []
+    for number in numbers:
+        if number is None:
+            links.append(PAGE_ELLIPSIS)
+        else:
+            url = "?" + querystring_template.render([(key, [number])])
+            links.append((number, url, number == current))
+    return links
+
+#
+# Facets
+#
+
+def facet_links(query_dict, key, values, cache=None):
+    """
+    Return toggle links for each of ``values`` of the facet ``key``, as a
+    list of ``(value, url, is_selected)`` tuples, like the ``facet_links``
+    tag. A value is selected when it is one of the values for ``key`` in
+    ``query_dict``. The URL of a selected value removes it from those
+    values, and the URL of any other value adds it to them. URLs are
+    rendered as ``modified_url`` renders them.
+
+    The rest of the querystring is encoded once for every link. A
+    ``QueryStringTemplateCache`` may be given to reuse it across calls.
+    """
+    selected = query_dict.getlist(key)
+    if cache is None:
+        querystring_template = QueryStringTemplate(query_dict, [key])
+    else:
+        querystring_template = cache.get_template(query_dict, [key])
+    links = []
+    for value in values:
+        text = force_unicode(value)
+        if text in selected:
+            toggled = [other for other in selected if other != text]
+        else:
+            toggled = selected + [text]
+        url = "?" + querystring_template.render([(key, toggled)])
+        links.append((value, url, text in selected))
+    return links
+
+#
+# Sorting
+#
+
+def parse_sort(values):
+    """
+    Return the sort order given by ``values`` as a list of ``(column,
+    direction)`` pairs, where ``direction`` is ``"asc"`` or ``"desc"``. Each
+    value is a column name, prefixed with ``-`` for a descending sort.
+    """
+    order = []
+    seen = set()
+    for value in values:
+        value = force_unicode(value)
+        if value.startswith(u"-"):
+            column, direction = value[1:], "desc"
+        else:
+            column, direction = value, "asc"
+        if column and column not in seen:
+            seen.add(column)
+            order.append((column, direction))
+    return order
+
+def format_sort(order):
+    """
+    Return the values giving the sort order ``order``, the reverse of
+    ``parse_sort``.
+    """
+    return [
+        direction == "desc" and u"-" + column or column
+        for column, direction in order
+    ]
+
+def sort_links(query_dict, key, columns, multiple=False, cache=None):
+    """
+    Return sort links for each of ``columns``, as a list of ``(column, url,
+    is_active, direction)`` tuples, like the ``sort_links`` tag. The values
+    for ``key`` in ``query_dict`` give the current sort order, as read by
+    ``parse_sort``. ``direction`` is that of the column in the current order,
+    or ``None`` when it is not sorted on.
+
+    The URL of the column sorted on first reverses its direction, and that
+    of any other column sorts on it in ascending order. With ``multiple``,
+    the rest of the current order is kept after the column, so that it is
+    sorted on first while the previous order breaks ties.
+
+    The rest of the querystring is encoded once for every link. A
+    ``QueryStringTemplateCache`` may be given to reuse it across calls.
+    """
+    order = parse_sort(query_dict.getlist(key))
+    directions = dict(order)
+    primary = order and order[0][0] or None
+    if cache is None:
+        querystring_template = QueryStringTemplate(query_dict, [key])
+    else:
+        querystring_template = cache.get_template(query_dict, [key])
+    links = []
+    for column in columns:
+        column = force_unicode(column)
+        direction = directions.get(column)
+        if column == primary and direction == "asc":
+            new_order = [(column, "desc")]
+        else:
+            new_order = [(column, "asc")]
+        if multiple:
+            new_order.extend([
+                (other, other_direction) for other, other_direction in order
+                if other != column
+            ])
+        url = "?" + querystring_template.render([(key, format_sort(new_order))])
+        links.append((column, url, direction is not None, direction))
+    return links
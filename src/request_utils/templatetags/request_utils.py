@@ -1,7 +1,21 @@
-from urlparse import urljoin
+from __future__ import absolute_import
+
+import re
 
 from django import template
-from django.http import QueryDict
+from django.conf import settings
+from django.utils.hashcompat import md5_constructor
+
+from request_utils import instrumentation
+from request_utils.context_processors import RequestLocation
+from request_utils.datastructures import QueryDictOverlay
+from request_utils.encoding import QueryStringTemplateCache
+from request_utils.location import get_query_fingerprint
+from request_utils.query import (
+    QueryBuilder, append_key, clone_query_dict, current_location, delete_key,
+    facet_links, freeze_query_dict, new_query_dict, page_links, qualified_url,
+    qualified_urls, replace_key, sort_links, update_query_dict
+)
 
 register = template.Library()
 
@@ -21,159 +35,699 @@ def resolve_value(variable, context):
         return variable.resolve(context)
     return variable
 
+class Literal(object):
+    """
+    A tag argument whose value is known when the template is compiled.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return "<Literal: %r>" % (self.value,)
+
+    def resolve(self, context):
+        return self.value
+
+class Expression(object):
+    """
+    A tag argument resolved from the context when the template is rendered.
+    Failed lookups raise ``template.VariableDoesNotExist``.
+    """
+    def __init__(self, filter_expression):
+        self.filter_expression = filter_expression
+
+    def __repr__(self):
+        return "<Expression: %r>" % self.filter_expression.token
+
+    def resolve(self, context):
+        result = self.filter_expression.resolve(context, ignore_failures=True)
+        if result is None:
+            raise template.VariableDoesNotExist(
+                'Failed lookup for "%s"' % self.filter_expression
+            )
+        return result
+
+def make_resolver(variable):
+    """
+    Return an object resolving ``variable`` the way ``resolve_value`` would,
+    deciding at compile time how it should be resolved.
+
+    Quoted literals and numbers without filters become a ``Literal``, other
+    filter expressions an ``Expression``. ``template.Variable`` objects are
+    returned as they are, any other object is wrapped in a ``Literal`` and
+    ``None`` is passed through.
+    """
+    if variable is None or isinstance(variable, (Literal, Expression)):
+        return variable
+    if isinstance(variable, template.FilterExpression):
+        if not variable.filters:
+            var = variable.var
+            if isinstance(var, template.Variable):
+                if var.lookups is None and not var.translate:
+                    return Literal(var.literal)
+            elif var is not None:
+                return Literal(var)
+        return Expression(variable)
+    if hasattr(variable, "resolve"):
+        return variable
+    return Literal(variable)
+
+# Compiled tag arguments without filters, shared by every template. Without
+# filters, an argument compiles the same whatever libraries are loaded.
+_compiled_values = {}
+
+def compile_value(parser, bit):
+    """
+    Compile a tag argument into a ``Literal`` or an ``Expression``.
+
+    Arguments without filters are compiled once per process, and the same
+    resolver is reused for every later occurrence of the argument, up to
+    ``REQUEST_UTILS_COMPILED_VALUES_SIZE`` distinct arguments.
+    """
+    try:
+        return _compiled_values[bit]
+    except KeyError:
+        pass
+    filter_expression = parser.compile_filter(bit)
+    resolver = make_resolver(filter_expression)
+    if not filter_expression.filters and len(_compiled_values) < getattr(
+            settings, "REQUEST_UTILS_COMPILED_VALUES_SIZE", 4096):
+        _compiled_values[bit] = resolver
+    return resolver
+
+def resolve_values(resolvers, context):
+    """
+    Resolve each of ``resolvers``, leaving out those that fail to resolve.
+    """
+    values = []
+    for resolver in resolvers:
+        try:
+            values.append(resolver.resolve(context))
+        except template.VariableDoesNotExist:
+            continue
+    return values
+
+REQUEST_VARIABLE = template.Variable("request")
+
+# The name the ``request_location`` context processor adds its
+# ``RequestLocation`` as.
+REQUEST_LOCATION_NAME = "request_location"
+
+def get_request_location(context, request):
+    """
+    Return the ``RequestLocation`` added to the context by the
+    ``request_location`` context processor, or ``None``.
+
+    It is only used when the tag takes the request from the context, that
+    is when ``request`` is ``REQUEST_VARIABLE``. A context variable of the
+    same name holding anything else is ignored.
+    """
+    if request is not REQUEST_VARIABLE:
+        return None
+    request_location = context.get(REQUEST_LOCATION_NAME)
+    if isinstance(request_location, RequestLocation):
+        return request_location
+    return None
+
+QUERYSTRING_CACHE_ATTR = "_request_utils_querystring_cache"
+
+def get_querystring_cache(context):
+    """
+    Return the ``QueryStringTemplateCache`` for the current request, or for
+    the current template render when there is no request in the context.
+    """
+    try:
+        request = REQUEST_VARIABLE.resolve(context)
+    except template.VariableDoesNotExist:
+        request = None
+    if request is None:
+        cache = context.render_context.get(QUERYSTRING_CACHE_ATTR)
+        if cache is None:
+            cache = QueryStringTemplateCache()
+            context.render_context[QUERYSTRING_CACHE_ATTR] = cache
+        return cache
+    cache = getattr(request, QUERYSTRING_CACHE_ATTR, None)
+    if cache is None:
+        cache = QueryStringTemplateCache()
+        setattr(request, QUERYSTRING_CACHE_ATTR, cache)
+    return cache
+
+LOCAL_QUERY_DICTS_ATTR = "_request_utils_local_query_dicts"
+
+def is_concurrency_safe():
+    """
+    Return whether the ``REQUEST_UTILS_CONCURRENCY_SAFE`` setting is on.
+    """
+    return getattr(settings, "REQUEST_UTILS_CONCURRENCY_SAFE", False)
+
+def get_local_query_dicts(context):
+    """
+    Return the mapping of ``id`` to object of the query dicts created during
+    the current render, which the tags may modify in place.
+    """
+    local = getattr(context, LOCAL_QUERY_DICTS_ATTR, None)
+    if local is None:
+        local = {}
+        setattr(context, LOCAL_QUERY_DICTS_ATTR, local)
+    return local
+
+def make_local(query_dict, context):
+    """
+    Record ``query_dict`` as created during the current render when in
+    concurrency-safe mode, and return it.
+    """
+    if is_concurrency_safe():
+        get_local_query_dicts(context)[id(query_dict)] = query_dict
+    return query_dict
+
+def get_variable_name(resolver):
+    """
+    Return the context variable name ``resolver`` looks up, or ``None`` if
+    it is not a plain variable name.
+    """
+    if isinstance(resolver, Expression):
+        filter_expression = resolver.filter_expression
+        var = filter_expression.var
+        if (not filter_expression.filters and isinstance(var, template.Variable)
+                and var.lookups and len(var.lookups) == 1):
+            return var.lookups[0]
+    return None
+
+def resolve_writable(resolver, name, context):
+    """
+    Resolve the ``QueryDict`` a tag is about to modify.
+
+    In concurrency-safe mode, a ``QueryDict`` that was not created during the
+    current render may be shared with other threads, so it is never modified.
+    A copy-on-write ``QueryDictOverlay`` of it is returned instead, and
+    replaces it in the context under ``name``. When it was not given as a
+    plain variable name, it cannot be replaced and
+    ``template.VariableDoesNotExist`` is raised.
+    """
+    query_dict = resolver.resolve(context)
+    if not is_concurrency_safe():
+        return query_dict
+    local = get_local_query_dicts(context)
+    if local.get(id(query_dict)) is query_dict:
+        return query_dict
+    if name is None:
+        raise template.VariableDoesNotExist(
+            "Cannot modify a shared QueryDict not given by name"
+        )
+    if isinstance(query_dict, QueryDictOverlay):
+        overlay = query_dict.copy()
+    else:
+        overlay = QueryDictOverlay(query_dict)
+    local[id(overlay)] = overlay
+    for dict_ in reversed(context.dicts):
+        if name in dict_:
+            dict_[name] = overlay
+            break
+    else:
+        context[name] = overlay
+    return overlay
+
 #
 # Nodes
 #
 
 class QueryDictAppendNode(template.Node):
     def __init__(self, query_dict, key, values):
-        self.query_dict = query_dict
-        self.key = key
-        self.values = values
+        self.query_dict = make_resolver(query_dict)
+        self.name = get_variable_name(self.query_dict)
+        self.key = make_resolver(key)
+        self.values = [make_resolver(value) for value in values]
 
     def render(self, context):
         try:
-            query_dict = resolve_value(self.query_dict, context)
-            key = resolve_value(self.key, context)
+            query_dict = resolve_writable(self.query_dict, self.name, context)
+            key = self.key.resolve(context)
         except template.VariableDoesNotExist:
             return u""
-        for value in self.values:
-            try:
-                query_dict.appendlist(key, resolve_value(value, context))
-            except template.VariableDoesNotExist:
-                continue
+        append_key(query_dict, key, *resolve_values(self.values, context))
         return u""
 
 class QueryDictReplaceNode(template.Node):
     def __init__(self, query_dict, key, values):
-        self.query_dict = query_dict
-        self.key = key
-        self.values = values
+        self.query_dict = make_resolver(query_dict)
+        self.name = get_variable_name(self.query_dict)
+        self.key = make_resolver(key)
+        self.values = [make_resolver(value) for value in values]
 
     def render(self, context):
         try:
-            query_dict = resolve_value(self.query_dict, context)
-            key = resolve_value(self.key, context)
+            query_dict = resolve_writable(self.query_dict, self.name, context)
+            key = self.key.resolve(context)
         except template.VariableDoesNotExist:
             return u""
-        if key in query_dict:
-            del query_dict[key]
-        for value in self.values:
-            try:
-                query_dict.appendlist(key, resolve_value(value, context))
-            except template.VariableDoesNotExist:
-                continue
+        replace_key(query_dict, key, *resolve_values(self.values, context))
         return u""
 
 class QueryDictDeleteKeyNode(template.Node):
     def __init__(self, query_dict, keys):
-        self.query_dict = query_dict
-        self.keys = keys
+        self.query_dict = make_resolver(query_dict)
+        self.name = get_variable_name(self.query_dict)
+        self.keys = [make_resolver(key) for key in keys]
 
     def render(self, context):
         try:
-            query_dict = resolve_value(self.query_dict, context)
+            query_dict = resolve_writable(self.query_dict, self.name, context)
         except template.VariableDoesNotExist:
             return u""
-        for key in self.keys:
-            try:
-                key = resolve_value(key, context)
-                del query_dict[key]
-            except (KeyError, template.VariableDoesNotExist):
-                continue
+        delete_key(query_dict, *resolve_values(self.keys, context))
         return u""
 
 class QueryDictUpdateNode(template.Node):
     def __init__(self, query_dict, others):
-        self.query_dict = query_dict
-        self.others = others
+        self.query_dict = make_resolver(query_dict)
+        self.name = get_variable_name(self.query_dict)
+        self.others = [make_resolver(other) for other in others]
 
     def render(self, context):
         try:
-            query_dict = resolve_value(self.query_dict, context)
+            query_dict = resolve_writable(self.query_dict, self.name, context)
         except template.VariableDoesNotExist:
             return u""
-        for other in self.others:
-            try:
-                other = resolve_value(other, context)
-                query_dict.update(other)
-            except template.VariableDoesNotExist:
-                continue
+        update_query_dict(query_dict, *resolve_values(self.others, context))
         return u""
 
 class QueryDictCloneNode(template.Node):
-    def __init__(self, query_dict, as_var):
-        self.var = query_dict
-        self.as_var = as_var
+    def __init__(self, query_dict, as_var, canonical=False):
+        self.var = make_resolver(query_dict)
+        self.as_var = make_resolver(as_var)
+        self.canonical = canonical
 
     def render(self, context):
         try:
-            query_dict = resolve_value(self.var, context)
-            as_var = resolve_value(self.as_var, context)
-            context[as_var] = query_dict.copy()
+            query_dict = self.var.resolve(context)
+            as_var = self.as_var.resolve(context)
+            context[as_var] = make_local(
+                clone_query_dict(query_dict, self.canonical), context
+            )
+        except template.VariableDoesNotExist:
+            pass
+        return u""
+
+class FreezeQueryDictNode(template.Node):
+    def __init__(self, query_dict, as_var, canonical=False):
+        self.var = make_resolver(query_dict)
+        self.as_var = make_resolver(as_var)
+        self.canonical = canonical
+
+    def render(self, context):
+        try:
+            query_dict = self.var.resolve(context)
+            as_var = self.as_var.resolve(context)
+            context[as_var] = freeze_query_dict(query_dict, self.canonical)
         except template.VariableDoesNotExist:
             pass
         return u""
 
 class QueryDictNode(template.Node):
     def __init__(self, as_var):
-        self.as_var = as_var
+        self.as_var = make_resolver(as_var)
 
     def render(self, context):
         try:
-            as_var = resolve_value(self.as_var, context)
-            context[as_var] = QueryDict("", mutable=True)
+            as_var = self.as_var.resolve(context)
+            context[as_var] = make_local(new_query_dict(), context)
         except template.VariableDoesNotExist:
             pass
         return u""
 
 class QualifiedURLNode(template.Node):
-    def __init__(self, path, as_var=None):
-        self.path = path
-        self.as_var = as_var
+    def __init__(self, path, as_var=None, request=None, canonical=False):
+        self.path = make_resolver(path)
+        self.as_var = make_resolver(as_var)
+        self.request = make_resolver(request) or REQUEST_VARIABLE
+        self.canonical = canonical
 
     def render(self, context):
         try:
-            request = template.Variable("request").resolve(context)
-            path = resolve_value(self.path, context)
+            path = self.path.resolve(context)
         except template.VariableDoesNotExist:
             return u""
-        url = request.build_absolute_uri(path)
+        request_location = get_request_location(context, self.request)
+        if request_location is not None:
+            request = request_location.request
+        else:
+            try:
+                request = self.request.resolve(context)
+            except template.VariableDoesNotExist:
+                if not getattr(settings, "REQUEST_UTILS_BASE_URL", None):
+                    return u""
+                request = None
+        url = qualified_url(path, request, self.canonical)
         if self.as_var:
             try:
-                as_var = resolve_value(self.as_var, context)
+                as_var = self.as_var.resolve(context)
                 context[as_var] = url
                 return u""
             except template.VariableDoesNotExist:
                 return u""
         return url
 
+class QualifiedURLsNode(template.Node):
+    def __init__(self, paths, as_var, request=None, canonical=False):
+        self.paths = make_resolver(paths)
+        self.as_var = make_resolver(as_var)
+        self.request = make_resolver(request) or REQUEST_VARIABLE
+        self.canonical = canonical
+
+    def render(self, context):
+        try:
+            paths = self.paths.resolve(context)
+            as_var = self.as_var.resolve(context)
+        except template.VariableDoesNotExist:
+            return u""
+        request_location = get_request_location(context, self.request)
+        if request_location is not None:
+            request = request_location.request
+        else:
+            try:
+                request = self.request.resolve(context)
+            except template.VariableDoesNotExist:
+                if not getattr(settings, "REQUEST_UTILS_BASE_URL", None):
+                    return u""
+                request = None
+        context[as_var] = list(qualified_urls(paths, request, self.canonical))
+        return u""
+
 class CurrentLocationNode(template.Node):
-    def __init__(self, as_var=None):
-        self.as_var = as_var
+    def __init__(self, as_var=None, request=None, canonical=False):
+        self.as_var = make_resolver(as_var)
+        self.request = make_resolver(request) or REQUEST_VARIABLE
+        self.canonical = canonical
+
+    def render(self, context):
+        request_location = get_request_location(context, self.request)
+        if request_location is not None:
+            url = request_location.get_location(self.canonical)
+        else:
+            try:
+                request = self.request.resolve(context)
+            except template.VariableDoesNotExist:
+                return u""
+            url = current_location(request, self.canonical)
+        if self.as_var:
+            try:
+                as_var = self.as_var.resolve(context)
+                context[as_var] = url
+                return u""
+            except template.VariableDoesNotExist:
+                return u""
+        return url
+
+class ModifiedURLNode(template.Node):
+    def __init__(self, query_dict, changes, as_var=None):
+        self.query_dict = make_resolver(query_dict)
+        self.changes = [
+            (key, make_resolver(value)) for key, value in changes
+        ]
+        self.as_var = make_resolver(as_var)
 
     def render(self, context):
         try:
-            request = template.Variable("request").resolve(context)
+            query_dict = self.query_dict.resolve(context)
         except template.VariableDoesNotExist:
             return u""
-        url = request.path
-        querystring = request.GET.urlencode()
-        if querystring:
-            url = "?".join([url, querystring])
+        changes = []
+        for key, value in self.changes:
+            if value is not None:
+                try:
+                    value = [value.resolve(context)]
+                except template.VariableDoesNotExist:
+                    continue
+            changes.append((key, value))
+        url = QueryBuilder(query_dict, changes).url(
+            cache=get_querystring_cache(context)
+        )
         if self.as_var:
             try:
-                as_var = resolve_value(self.as_var, context)
+                as_var = self.as_var.resolve(context)
                 context[as_var] = url
                 return u""
             except template.VariableDoesNotExist:
                 return u""
         return url
 
+class PageLinksNode(template.Node):
+    def __init__(self, query_dict, key, page, window, as_var):
+        self.query_dict = make_resolver(query_dict)
+        self.key = make_resolver(key)
+        self.page = make_resolver(page)
+        self.window = make_resolver(window)
+        self.as_var = make_resolver(as_var)
+
+    def render(self, context):
+        try:
+            query_dict = self.query_dict.resolve(context)
+            key = self.key.resolve(context)
+            page = self.page.resolve(context)
+            window = self.window.resolve(context)
+            as_var = self.as_var.resolve(context)
+        except template.VariableDoesNotExist:
+            return u""
+        context[as_var] = page_links(
+            query_dict, key, page, window, cache=get_querystring_cache(context)
+        )
+        return u""
+
+class FacetLinksNode(template.Node):
+    def __init__(self, query_dict, key, values, as_var):
+        self.query_dict = make_resolver(query_dict)
+        self.key = make_resolver(key)
+        self.values = make_resolver(values)
+        self.as_var = make_resolver(as_var)
+
+    def render(self, context):
+        try:
+            query_dict = self.query_dict.resolve(context)
+            key = self.key.resolve(context)
+            values = self.values.resolve(context)
+            as_var = self.as_var.resolve(context)
+        except template.VariableDoesNotExist:
+            return u""
+        context[as_var] = facet_links(
+            query_dict, key, values, cache=get_querystring_cache(context)
+        )
+        return u""
+
+def parse_keys(keys):
+    """
+    Return the list of keys given by ``keys``, either a comma separated
+    string or a sequence of keys.
+    """
+    if isinstance(keys, basestring):
+        return [key.strip() for key in keys.split(u",") if key.strip()]
+    return list(keys)
+
+class SortLinksNode(template.Node):
+    def __init__(self, query_dict, key, columns, as_var, multiple=False):
+        self.query_dict = make_resolver(query_dict)
+        self.key = make_resolver(key)
+        columns = make_resolver(columns)
+        if isinstance(columns, Literal):
+            columns = Literal(parse_keys(columns.value))
+        self.columns = columns
+        self.as_var = make_resolver(as_var)
+        self.multiple = multiple
+
+    def render(self, context):
+        try:
+            query_dict = self.query_dict.resolve(context)
+            key = self.key.resolve(context)
+            columns = parse_keys(self.columns.resolve(context))
+            as_var = self.as_var.resolve(context)
+        except template.VariableDoesNotExist:
+            return u""
+        context[as_var] = sort_links(
+            query_dict, key, columns, self.multiple,
+            cache=get_querystring_cache(context)
+        )
+        return u""
+
+class CacheByQueryNode(template.Node):
+    def __init__(self, nodelist, timeout, keys, fragment):
+        self.nodelist = nodelist
+        self.timeout = make_resolver(timeout)
+        keys = make_resolver(keys)
+        if isinstance(keys, Literal):
+            keys = Literal(parse_keys(keys.value))
+        self.keys = keys
+        # Identifies the cached fragment, shared by identical fragments.
+        self.fragment = fragment
+
+    def render(self, context):
+        from django.core.cache import cache
+        try:
+            timeout = self.timeout.resolve(context)
+            keys = parse_keys(self.keys.resolve(context))
+            request = REQUEST_VARIABLE.resolve(context)
+        except template.VariableDoesNotExist:
+            return self.nodelist.render(context)
+        try:
+            timeout = int(timeout)
+        except (ValueError, TypeError):
+            raise template.TemplateSyntaxError(
+                "'cache_by_query' tag got a non-integer timeout value: %r"
+                % timeout
+            )
+        cache_key = "request_utils.cache_by_query.%s.%s" % (
+            self.fragment,
+            get_query_fingerprint(request.path, request.GET, keys),
+        )
+        value = cache.get(cache_key)
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(cache_key, value, timeout)
+        return value
+
+class EditQueryDictNode(template.Node):
+    def __init__(self, query_dict, operations, as_var=None):
+        self.query_dict = make_resolver(query_dict)
+        self.name = get_variable_name(self.query_dict)
+        self.operations = [
+            (operation, [make_resolver(arg) for arg in args])
+            for operation, args in operations
+        ]
+        self.as_var = make_resolver(as_var)
+
+    def resolve_operations(self, context):
+        """
+        Resolve the arguments of every operation, leaving out the arguments
+        and the keyed operations that fail to resolve.
+        """
+        resolved = []
+        for operation, args in self.operations:
+            values = []
+            for arg in args:
+                try:
+                    values.append(arg.resolve(context))
+                except template.VariableDoesNotExist:
+                    if not values and operation in ("append", "replace"):
+                        break
+            else:
+                resolved.append((operation, values))
+        return resolved
+
+    def render(self, context):
+        try:
+            if self.as_var:
+                query_dict = self.query_dict.resolve(context)
+                as_var = self.as_var.resolve(context)
+            else:
+                query_dict = resolve_writable(
+                    self.query_dict, self.name, context
+                )
+        except template.VariableDoesNotExist:
+            return u""
+        operations = self.resolve_operations(context)
+        if self.as_var:
+            query_dict = make_local(clone_query_dict(query_dict), context)
+        for operation, values in operations:
+            EDIT_FUNCTIONS[operation](query_dict, *values)
+        if self.as_var:
+            context[as_var] = query_dict
+        return u""
+
+EDIT_FUNCTIONS = {
+    "append": append_key,
+    "replace": replace_key,
+    "delete": delete_key,
+    "update": update_query_dict,
+}
+
 #
 # Compilation Functions
 #
 
+kwarg_re = re.compile(r"^(\w+)=(.+)$")
+
+class TagArguments(object):
+    """
+    The arguments of a tag, compiled by ``parse_arguments``.
+
+    ``args`` is the list of positional arguments and ``kwargs`` maps keyword
+    names to arguments, each compiled into a ``Literal`` or an
+    ``Expression``. ``flags`` is the set of flags given, and ``suffixes``
+    maps the suffix keywords given, such as ``as``, to their compiled
+    argument.
+    """
+    def __init__(self, tag_name, args, kwargs, flags, suffixes):
+        self.tag_name = tag_name
+        self.args = args
+        self.kwargs = kwargs
+        self.flags = flags
+        self.suffixes = suffixes
+
+    def __repr__(self):
+        return "<TagArguments: %s>" % self.tag_name
+
+    def _get_as_var(self):
+        return self.suffixes.get(u"as")
+
+    as_var = property(_get_as_var)
+
+    def get(self, name, default=None):
+        """
+        Return the compiled keyword argument ``name``, or ``default`` as a
+        ``Literal`` when it was not given.
+        """
+        try:
+            return self.kwargs[name]
+        except KeyError:
+            return make_resolver(default)
+
+def parse_arguments(parser, token, keywords=(), flags=(), suffixes=(u"as",),
+                    required=0):
+    """
+    Compile the arguments of the tag in ``token`` into ``TagArguments``.
+
+    The arguments are read from the end: first the ``suffixes``, keywords
+    each followed by one argument, such as ``for <request>`` and
+    ``as <name>``, in the order they must be given in; then any ``flags``,
+    bare words such as ``canonical``, as long as at least ``required``
+    arguments are left before them, so that a context variable of the same
+    name can still be given as an argument. Of the rest, ``key=value``
+    arguments whose key is one of ``keywords`` are keyword arguments, and the
+    others positional arguments.
+
+    Every argument is compiled with ``compile_value``, so that quoted
+    literals and numbers are resolved once, at compile time.
+    """
+    bits = token.split_contents()
+    tag_name, bits = bits[0], bits[1:]
+    compiled_suffixes = {}
+    for suffix in reversed(suffixes):
+        if len(bits) >= 2 and bits[-2] == suffix:
+            compiled_suffixes[suffix] = compile_value(parser, bits[-1])
+            bits = bits[:-2]
+    given_flags = set()
+    while (len(bits) > required and bits[-1] in flags
+           and bits[-1] not in given_flags):
+        given_flags.add(bits.pop())
+    args = []
+    kwargs = {}
+    for bit in bits:
+        match = keywords and kwarg_re.match(bit)
+        if match:
+            name, value = match.groups()
+            if name not in keywords:
+                raise template.TemplateSyntaxError(
+                    "'%s' tag received an unexpected keyword argument '%s'"
+                    % (tag_name, name)
+                )
+            if name in kwargs:
+                raise template.TemplateSyntaxError(
+                    "'%s' tag received the keyword argument '%s' twice"
+                    % (tag_name, name)
+                )
+            kwargs[name] = compile_value(parser, value)
+        else:
+            args.append(compile_value(parser, bit))
+    return TagArguments(tag_name, args, kwargs, given_flags, compiled_suffixes)
+
 def compile_append_key(parser, token):
     """
     Appends one or more value(s) to the list of values for the given ``key``
@@ -186,16 +740,14 @@ def compile_append_key(parser, token):
     Note that the ``key`` and ``value`` arguments may be specified as template
     context variable names or quoted literals.
     """
-    bits = token.split_contents()
-    if not len(bits) > 3:
+    arguments = parse_arguments(parser, token, suffixes=())
+    if not len(arguments.args) > 2:
         raise template.TemplateSyntaxError(
             "'%s' tag requires at least three values: a querydict, a key, and"
-            " one or more values to append" % bits[0]
+            " one or more values to append" % arguments.tag_name
         )
-    query_dict = parser.compile_filter(bits[1])
-    key = parser.compile_filter(bits[2])
-    values = [parser.compile_filter(bit) for bit in bits[3:]]
-    return QueryDictAppendNode(query_dict, key, values)
+    query_dict, key = arguments.args[:2]
+    return QueryDictAppendNode(query_dict, key, arguments.args[2:])
 
 def compile_replace_key(parser, token):
     """
@@ -209,16 +761,14 @@ def compile_replace_key(parser, token):
     Note that ``key`` and each ``value`` may refer to other template context
     variables or be given as quoted literals.
     """
-    bits = token.split_contents()
-    if not len(bits) > 3:
+    arguments = parse_arguments(parser, token, suffixes=())
+    if not len(arguments.args) > 2:
         raise template.TemplateSyntaxError(
             "'%s' tag requires at least three values: a querydict, a key,"
-            " and one or more values to set for the key" % bits[0]
+            " and one or more values to set for the key" % arguments.tag_name
         )
-    query_dict = parser.compile_filter(bits[1])
-    key = parser.compile_filter(bits[2])
-    values = [parser.compile_filter(bit) for bit in bits[3:]]
-    return QueryDictReplaceNode(query_dict, key, values)
+    query_dict, key = arguments.args[:2]
+    return QueryDictReplaceNode(query_dict, key, arguments.args[2:])
 
 def compile_delete_key(parser, token):
     """
@@ -231,15 +781,13 @@ def compile_delete_key(parser, token):
     Note that the ``key`` arguments may be specified as template context
     variables or as quoted literals.
     """
-    bits = token.split_contents()
-    if not len(bits) >= 3:
+    arguments = parse_arguments(parser, token, suffixes=())
+    if not len(arguments.args) >= 2:
         raise template.TemplateSyntaxError(
             "'%s' tag requires at least two values: a querydict and one"
-            " or more keys to delete" % bits[0]
+            " or more keys to delete" % arguments.tag_name
         )
-    query_dict = parser.compile_filter(bits[1])
-    keys = [parser.compile_filter(bit) for bit in bits[2:]]
-    return QueryDictDeleteKeyNode(query_dict, keys)
+    return QueryDictDeleteKeyNode(arguments.args[0], arguments.args[1:])
 
 def compile_update_query_dict(parser, token):
     """
@@ -251,15 +799,13 @@ def compile_update_query_dict(parser, token):
         {% update_query_dict <querydict> [<other> ...] %}
 
     """
-    bits = token.split_contents()
-    if not len(bits) >= 3:
+    arguments = parse_arguments(parser, token, suffixes=())
+    if not len(arguments.args) >= 2:
         raise template.TemplateSyntaxError(
             "'%s' tag requires at least two values: a querydict to update"
-            " and one or more dicts to merge" % bits[0]
+            " and one or more dicts to merge" % arguments.tag_name
         )
-    query_dict = parser.compile_filter(bits[1])
-    others = [parser.compile_filter(bit) for bit in bits[2:]]
-    return QueryDictUpdateNode(query_dict, others)
+    return QueryDictUpdateNode(arguments.args[0], arguments.args[1:])
 
 def compile_clone_query_dict(parser, token):
     """
@@ -268,18 +814,50 @@ def compile_clone_query_dict(parser, token):
 
     Usage::
       
-        {% clone_query_dict <querydict> as <name> %}
+        {% clone_query_dict <querydict> [canonical] as <name> %}
     
+    With ``canonical``, the clone has the canonical contents of the
+    ``QueryDict``: keys and values sorted, and empty values and denylisted
+    keys left out.
     """
-    bits = token.split_contents()
-    if not len(bits) == 4 or not bits[2] == u"as":
+    arguments = parse_arguments(
+        parser, token, flags=(u"canonical",), required=1
+    )
+    if not len(arguments.args) == 1 or arguments.as_var is None:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: querydict variable,"
+            " optionally 'canonical', 'as', and a context variable name"
+            % arguments.tag_name
+        )
+    return QueryDictCloneNode(
+        arguments.args[0], arguments.as_var, u"canonical" in arguments.flags
+    )
+
+def compile_freeze_query_dict(parser, token):
+    """
+    Store an immutable, hashable ``FrozenQueryDict`` copy of the specified
+    ``QueryDict`` template variable into a context variable specified by
+    ``name``.
+
+    Usage::
+
+        {% freeze_query_dict <querydict> [canonical] as <name> %}
+
+    With ``canonical``, empty values and denylisted keys are left out and
+    the values of each key are sorted.
+    """
+    arguments = parse_arguments(
+        parser, token, flags=(u"canonical",), required=1
+    )
+    if not len(arguments.args) == 1 or arguments.as_var is None:
         raise template.TemplateSyntaxError(
             "'%s' tag must be called with the arguments: querydict variable,"
-            " 'as', and a context variable name" % bits[0]
+            " optionally 'canonical', 'as', and a context variable name"
+            % arguments.tag_name
         )
-    query_dict = parser.compile_filter(bits[1])
-    as_var = parser.compile_filter(bits[3])
-    return QueryDictCloneNode(query_dict, as_var)
+    return FreezeQueryDictNode(
+        arguments.args[0], arguments.as_var, u"canonical" in arguments.flags
+    )
 
 def compile_query_dict(parser, token):
     """
@@ -290,14 +868,13 @@ def compile_query_dict(parser, token):
         {% query_dict as <name> %}
 
     """
-    bits = token.split_contents()
-    if not len(bits) == 3 or not bits[1] == u"as":
+    arguments = parse_arguments(parser, token)
+    if arguments.args or arguments.as_var is None:
         raise template.TemplateSyntaxError(
             "'%s' tag must be called with the arguments: 'as', and a context"
-            " variable name" % bits[0]
+            " variable name" % arguments.tag_name
         )
-    as_var = parser.compile_filter(bits[2])
-    return QueryDictNode(as_var)
+    return QueryDictNode(arguments.as_var)
 
 def compile_qualified_url(parser, token):
     """
@@ -305,28 +882,66 @@ def compile_qualified_url(parser, token):
 
     .. note::
         
-        This tag requires that the request object be available in context by
-        the name ``'request'``.
+        Unless a request is given with ``for``, this tag requires that the
+        request object be available in context by the name ``'request'``, or
+        that the ``REQUEST_UTILS_BASE_URL`` setting be set.
     
 
     Usage::
 
-        {% qualified_url <path> [as <name>] %}
+        {% qualified_url <path> [canonical] [for <request>] [as <name>] %}
 
+    With ``canonical``, the querystring of the path is put in canonical form.
     """
-    bits = token.split_contents()
-    if len(bits) == 2:
-        as_var = None
-    elif not len(bits) == 4 or not bits[2] == u"as":
+    arguments = parse_arguments(
+        parser, token, flags=(u"canonical",), suffixes=(u"for", u"as"),
+        required=1
+    )
+    if not len(arguments.args) == 1:
         raise template.TemplateSyntaxError(
-            "'%s' tag must be called with the arguments: 'as', and a context"
-            " variable name" % bits[0]
+            "'%s' tag must be called with the arguments: a path, optionally"
+            " followed by 'canonical', 'for' and a request, and 'as' and a"
+            " context variable name" % arguments.tag_name
         )
-    else:
-        as_var = parser.compile_filter(bits[3])
-    path = parser.compile_filter(bits[1])
-    return QualifiedURLNode(path, as_var)
-    
+    return QualifiedURLNode(
+        arguments.args[0], arguments.as_var, arguments.suffixes.get(u"for"),
+        u"canonical" in arguments.flags
+    )
+
+def compile_qualified_urls(parser, token):
+    """
+    Store the given paths as fully qualified URLs in a context variable
+    specified by ``name``, computing the scheme and host only once.
+
+    .. note::
+
+        Unless a request is given with ``for``, this tag requires that the
+        request object be available in context by the name ``'request'``, or
+        that the ``REQUEST_UTILS_BASE_URL`` setting be set.
+
+    Usage::
+
+        {% qualified_urls <paths> [canonical] [for <request>] as <name> %}
+
+    ``paths`` is an iterable of paths, or of objects with a
+    ``get_absolute_url`` method. The URLs are stored as a list, which may be
+    used any number of times. With ``canonical``, querystrings are put in
+    canonical form.
+    """
+    arguments = parse_arguments(
+        parser, token, flags=(u"canonical",), suffixes=(u"for", u"as"),
+        required=1
+    )
+    if not len(arguments.args) == 1 or arguments.as_var is None:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: the paths,"
+            " optionally followed by 'canonical', and 'for' and a request,"
+            " then 'as' and a context variable name" % arguments.tag_name
+        )
+    return QualifiedURLsNode(
+        arguments.args[0], arguments.as_var, arguments.suffixes.get(u"for"),
+        u"canonical" in arguments.flags
+    )
 
 def compile_current_location(parser, token):
     """
@@ -334,25 +949,268 @@ def compile_current_location(parser, token):
 
     .. note::
         
-        This tag requires that the request object be available in context by
-        the name ``'request'``.
+        Unless a request is given with ``for``, this tag requires that the
+        request object be available in context by the name ``'request'``.
+
+    Usage::
+
+        {% current_location [canonical] [for <request>] [as <name>] %}
+
+    With ``canonical``, the querystring is put in canonical form.
+    """
+    arguments = parse_arguments(
+        parser, token, flags=(u"canonical",), suffixes=(u"for", u"as")
+    )
+    if arguments.args:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: optionally"
+            " 'canonical', 'for' and a request, and 'as' and a context"
+            " variable name" % arguments.tag_name
+        )
+    return CurrentLocationNode(
+        arguments.as_var, arguments.suffixes.get(u"for"),
+        u"canonical" in arguments.flags
+    )
+
+def compile_modified_url(parser, token):
+    """
+    Render a relative URL made of ``?`` and the querystring of the given
+    ``QueryDict`` with keys replaced or removed, without copying or modifying
+    the ``QueryDict``.
 
     Usage::
 
-        {% current_location [as <name>] %}
+        {% modified_url <querydict> [<key>=<value> ...] [-<key> ...] [as <name>] %}
 
+    Each ``key=value`` argument replaces the values for ``key`` with
+    ``value``, and each ``-key`` argument removes ``key``. Keys are given
+    literally, while each ``value`` may refer to a template context variable
+    or be given as a quoted literal.
     """
     bits = token.split_contents()
-    if len(bits) == 1:
-        as_var = None
-    elif not len(bits) == 3 or not bits[1] == u"as":
+    as_var = None
+    if len(bits) >= 3 and bits[-2] == u"as":
+        as_var = compile_value(parser, bits[-1])
+        bits = bits[:-2]
+    if len(bits) < 2:
         raise template.TemplateSyntaxError(
-            "'%s' tag must be called with the arguments: 'as', and a context"
-            " variable name" % bits[0]
+            "'%s' tag requires at least one value: a querydict" % bits[0]
+        )
+    query_dict = compile_value(parser, bits[1])
+    changes = []
+    for bit in bits[2:]:
+        if bit.startswith(u"-") and len(bit) > 1:
+            changes.append((bit[1:], None))
+        elif u"=" in bit and not bit.startswith(u"="):
+            key, value = bit.split(u"=", 1)
+            changes.append((key, compile_value(parser, value)))
+        else:
+            raise template.TemplateSyntaxError(
+                "'%s' tag arguments must be of the form key=value or -key,"
+                " got '%s'" % (bits[0], bit)
+            )
+    return ModifiedURLNode(query_dict, changes, as_var)
+
+def compile_page_links(parser, token):
+    """
+    Store the links of a paginator for the given page in a context variable
+    specified by ``name``, as a list of ``(number, url, is_current)`` tuples.
+
+    Usage::
+
+        {% page_links <querydict> <key> <page> [window=<n>] as <name> %}
+
+    Each URL is made of ``?`` and the querystring of the ``QueryDict`` with
+    the values for ``key`` replaced by the page number. The links cover the
+    pages within ``window`` pages of the given page, 5 by default, and the
+    first and last pages. Runs of pages left out are given as
+    ``(None, None, False)``.
+    """
+    arguments = parse_arguments(parser, token, keywords=(u"window",))
+    if not len(arguments.args) == 3 or arguments.as_var is None:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: a querydict, a key,"
+            " a page, optionally 'window=' and a number of pages, 'as', and a"
+            " context variable name" % arguments.tag_name
+        )
+    query_dict, key, page = arguments.args
+    return PageLinksNode(
+        query_dict, key, page, arguments.get(u"window", 5), arguments.as_var
+    )
+
+def compile_facet_links(parser, token):
+    """
+    Store toggle links for each of the given values of a facet in a context
+    variable specified by ``name``, as a list of
+    ``(value, url, is_selected)`` tuples.
+
+    Usage::
+
+        {% facet_links <querydict> <key> <values> as <name> %}
+
+    A value is selected when it is one of the values for ``key`` in the
+    ``QueryDict``. The URL of a selected value removes it from those values,
+    and the URL of any other value adds it to them.
+    """
+    arguments = parse_arguments(parser, token)
+    if not len(arguments.args) == 3 or arguments.as_var is None:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: a querydict, a key,"
+            " a list of values, 'as', and a context variable name"
+            % arguments.tag_name
+        )
+    query_dict, key, values = arguments.args
+    return FacetLinksNode(query_dict, key, values, arguments.as_var)
+
+def compile_sort_links(parser, token):
+    """
+    Store sort links for each of the given columns in a context variable
+    specified by ``name``, as a list of ``(column, url, is_active,
+    direction)`` tuples.
+
+    Usage::
+
+        {% sort_links <querydict> <key> <columns> [multiple] as <name> %}
+
+    The values for ``key`` give the current sort order, each a column name
+    prefixed with ``-`` for a descending sort. ``columns`` is a comma
+    separated string or a list of column names. ``direction`` is ``"asc"``,
+    ``"desc"``, or ``None`` for columns that are not sorted on.
+
+    The URL of the column sorted on first reverses its direction, and that
+    of any other column sorts on it in ascending order. With ``multiple``,
+    the rest of the current order is kept after the column.
+    """
+    arguments = parse_arguments(
+        parser, token, flags=(u"multiple",), required=3
+    )
+    if not len(arguments.args) == 3 or arguments.as_var is None:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: a querydict, a key,"
+            " the columns, optionally 'multiple', 'as', and a context"
+            " variable name" % arguments.tag_name
+        )
+    query_dict, key, columns = arguments.args
+    return SortLinksNode(
+        query_dict, key, columns, arguments.as_var,
+        u"multiple" in arguments.flags
+    )
+
+def compile_cache_by_query(parser, token):
+    """
+    Caches the contents of a template fragment for ``timeout`` seconds,
+    keyed on the current request path and the values of the given querystring
+    ``keys``, in canonical order.
+
+    .. note::
+
+        This tag requires that the request object be available in context
+        by the name ``'request'``. Without it, the fragment is not cached.
+
+    Usage::
+
+        {% cache_by_query <timeout> keys=<keys> %}
+            ...
+        {% end_cache_by_query %}
+
+    ``keys`` is a comma separated string or a list of keys, e.g.
+    ``keys="q,sort,page"``. The fragment must depend on nothing else than the
+    path and these keys. Identical fragments share their cache entries.
+    """
+    arguments = parse_arguments(
+        parser, token, keywords=(u"keys",), suffixes=()
+    )
+    end_tag = u"end_%s" % arguments.tag_name
+    if not len(arguments.args) == 1 or u"keys" not in arguments.kwargs:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: a timeout, and"
+            " 'keys=' and the keys to cache on" % arguments.tag_name
+        )
+    timeout = arguments.args[0]
+    keys = arguments.kwargs[u"keys"]
+    start = len(parser.tokens)
+    tokens = parser.tokens[:]
+    nodelist = parser.parse((end_tag,))
+    parser.delete_first_token()
+    fragment = md5_constructor()
+    for body_token in tokens[:start - len(parser.tokens) - 1]:
+        fragment.update("%d:%s\0" % (
+            body_token.token_type, body_token.contents.encode("utf-8")
+        ))
+    return CacheByQueryNode(
+        nodelist, timeout, keys, fragment.hexdigest()
+    )
+
+EDIT_OPERATIONS = {
+    # operation: minimum number of arguments
+    "append": 2,
+    "replace": 2,
+    "delete": 1,
+    "update": 1,
+}
+
+def compile_edit_query_dict(parser, token):
+    """
+    Applies a batch of edits to the given ``QueryDict``, resolving it only
+    once. Every argument is resolved before any edit is applied.
+
+    Usage::
+
+        {% edit_query_dict <querydict> [as <name>] %}
+            {% append <key> [<value> ...] %}
+            {% replace <key> [<value> ...] %}
+            {% delete [<key> ...] %}
+            {% update [<other> ...] %}
+        {% end_edit_query_dict %}
+
+    The operations behave like the ``append_key``, ``replace_key``,
+    ``delete_key`` and ``update_query_dict`` tags. When ``as <name>`` is
+    given, the edits are applied to a clone of the ``QueryDict`` which is
+    stored in the context variable ``name``, as with ``clone_query_dict``.
+    """
+    arguments = parse_arguments(parser, token)
+    tag_name = arguments.tag_name
+    end_tag = u"end_%s" % tag_name
+    if not len(arguments.args) == 1:
+        raise template.TemplateSyntaxError(
+            "'%s' tag must be called with the arguments: a querydict,"
+            " optionally followed by 'as' and a context variable name"
+            % tag_name
         )
+    query_dict = arguments.args[0]
+    operations = []
+    while parser.tokens:
+        token = parser.next_token()
+        if token.token_type == template.TOKEN_COMMENT:
+            continue
+        if token.token_type == template.TOKEN_TEXT:
+            if token.contents.strip():
+                raise template.TemplateSyntaxError(
+                    "'%s' tag may only contain edit operations" % tag_name
+                )
+            continue
+        if token.token_type != template.TOKEN_BLOCK:
+            raise template.TemplateSyntaxError(
+                "'%s' tag may only contain edit operations" % tag_name
+            )
+        operation = token.contents.split(None, 1)[0]
+        if operation == end_tag:
+            break
+        if operation not in EDIT_OPERATIONS:
+            raise template.TemplateSyntaxError(
+                "'%s' is not a valid operation for the '%s' tag, expected one"
+                " of: %s" % (operation, tag_name, ", ".join(EDIT_OPERATIONS))
+            )
+        operation_arguments = parse_arguments(parser, token, suffixes=())
+        if len(operation_arguments.args) < EDIT_OPERATIONS[operation]:
+            raise template.TemplateSyntaxError(
+                "'%s' operation requires at least %d values"
+                % (operation, EDIT_OPERATIONS[operation])
+            )
+        operations.append((operation, operation_arguments.args))
     else:
-        as_var = parser.compile_filter(bits[2])
-    return CurrentLocationNode(as_var)
+        parser.unclosed_block_tag([end_tag])
+    return EditQueryDictNode(query_dict, operations, arguments.as_var)
 
 # Register those bad boys
 register.tag("append_key", compile_append_key)
@@ -360,6 +1218,36 @@ register.tag("replace_key", compile_replace_key)
 register.tag("delete_key", compile_delete_key)
 register.tag("update_query_dict", compile_update_query_dict)
 register.tag("clone_query_dict", compile_clone_query_dict)
+register.tag("freeze_query_dict", compile_freeze_query_dict)
 register.tag("query_dict", compile_query_dict)
 register.tag("qualified_url", compile_qualified_url)
 register.tag("current_location", compile_current_location)
+register.tag("modified_url", compile_modified_url)
+register.tag("edit_query_dict", compile_edit_query_dict)
+register.tag("page_links", compile_page_links)
+register.tag("facet_links", compile_facet_links)
+register.tag("cache_by_query", compile_cache_by_query)
+register.tag("sort_links", compile_sort_links)
+register.tag("qualified_urls", compile_qualified_urls)
+
+NODE_TAG_NAMES = {
+    QueryDictAppendNode: "append_key",
+    QueryDictReplaceNode: "replace_key",
+    QueryDictDeleteKeyNode: "delete_key",
+    QueryDictUpdateNode: "update_query_dict",
+    QueryDictCloneNode: "clone_query_dict",
+    FreezeQueryDictNode: "freeze_query_dict",
+    QueryDictNode: "query_dict",
+    QualifiedURLNode: "qualified_url",
+    CurrentLocationNode: "current_location",
+    ModifiedURLNode: "modified_url",
+    EditQueryDictNode: "edit_query_dict",
+    PageLinksNode: "page_links",
+    FacetLinksNode: "facet_links",
+    CacheByQueryNode: "cache_by_query",
+    SortLinksNode: "sort_links",
+    QualifiedURLsNode: "qualified_urls",
+}
+
+if getattr(settings, "REQUEST_UTILS_INSTRUMENTATION", False):
+    instrumentation.install(NODE_TAG_NAMES)
@@ -40,6 +40,33 @@ class RequestUtilsTemplateTagTestCase(unittest.TestCase):
         resolved = resolve_value(literal, context)
         self.assertEquals('foo', resolved)
 
+    def testMakeResolver(self):
+        from request_utils.templatetags.request_utils import (
+            Expression, Literal, make_resolver
+        )
+        parser = template.Parser([])
+        context = template.Context({'foo': 'bar'})
+        resolver = make_resolver(parser.compile_filter('"foo"'))
+        self.assertTrue(isinstance(resolver, Literal))
+        self.assertEquals('foo', resolver.resolve(context))
+        resolver = make_resolver(parser.compile_filter('2'))
+        self.assertTrue(isinstance(resolver, Literal))
+        self.assertEquals(2, resolver.resolve(context))
+        resolver = make_resolver(parser.compile_filter('"foo"|upper'))
+        self.assertTrue(isinstance(resolver, Expression))
+        self.assertEquals('FOO', resolver.resolve(context))
+        resolver = make_resolver(parser.compile_filter('foo'))
+        self.assertTrue(isinstance(resolver, Expression))
+        self.assertEquals('bar', resolver.resolve(context))
+        self.assertRaises(
+            template.VariableDoesNotExist,
+            resolver.resolve, template.Context({})
+        )
+        var = template.Variable('foo')
+        self.assertTrue(make_resolver(var) is var)
+        self.assertEquals('foo', make_resolver('foo').resolve(context))
+        self.assertEquals(None, make_resolver(None))
+
     def testAppendKey(self):
         t = '{% load request_utils %}{% append_key query_dict "foo" "baz" %}{{ query_dict.urlencode|safe }}'
         c = {
@@ -274,3 +301,1303 @@ class RequestUtilsTemplateTagTestCase(unittest.TestCase):
         }
         rendered = self.render_template(t, c)
         self.assertEquals('', rendered)
+
+    def testCloneQueryDictImmutableIsOverlay(self):
+        from request_utils.datastructures import QueryDictOverlay
+        t = '{% load request_utils %}{% clone_query_dict query_dict as "new" %}{% replace_key new "foo" "baz" %}{% append_key new "bar" "quux" %}{{ new.urlencode|safe }}|{{ query_dict.urlencode|safe }}'
+        c = template.Context({
+            'query_dict': QueryDict('foo=bar'),
+        })
+        rendered = template.Template(t).render(c)
+        self.assertEquals('foo=baz&bar=quux|foo=bar', rendered)
+        self.assertTrue(isinstance(c['new'], QueryDictOverlay))
+
+    def testModifiedURL(self):
+        t = '{% load request_utils %}{% modified_url query_dict page=page -sort q="new value" %}'
+        c = {
+            'query_dict': QueryDict('sort=name&page=1&filter=a&filter=b'),
+            'page': 2,
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals(
+            sorted(['page=2', 'filter=a', 'filter=b', 'q=new+value']),
+            sorted(rendered[1:].split('&'))
+        )
+        self.assertTrue(rendered.endswith('q=new+value'))
+        self.assertEquals(u'name', c['query_dict']['sort'])
+
+    def testModifiedURLWithAsVar(self):
+        t = '{% load request_utils %}{% modified_url query_dict -foo as "url" %}No output, then suddenly: {{ url|safe }}'
+        c = {
+            'query_dict': QueryDict('foo=bar'),
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals('No output, then suddenly: ?', rendered)
+
+    def testModifiedURLBadArgs(self):
+        t = '{% load request_utils %}{% modified_url query_dict page %}'
+        self.assertRaises(
+            template.TemplateSyntaxError,
+            template.Template, t
+        )
+
+    def testModifiedURLValueNotInContext(self):
+        t = '{% load request_utils %}{% modified_url query_dict foo=bar %}'
+        c = {
+            'query_dict': QueryDict('foo=baz'),
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals('?foo=baz', rendered)
+
+    def testModifiedURLQueryDictNotInContext(self):
+        t = '{% load request_utils %}{% modified_url query_dict foo="bar" %}'
+        rendered = self.render_template(t)
+        self.assertEquals('', rendered)
+
+    def testQualifiedURLForRequest(self):
+        t = '{% load request_utils %}{% qualified_url "/bar/" for req as "foo" %}{{ foo|safe }}'
+        c = {
+            'req': self.get_request('/foo/'),
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals('http://testserver/bar/', rendered)
+
+    def testCurrentLocationForRequest(self):
+        t = '{% load request_utils %}{% current_location for req %}'
+        c = {
+            'req': self.get_request('/foo/'),
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals('/foo/', rendered)
+
+    def testCurrentLocationForRequestNotInContext(self):
+        t = '{% load request_utils %}{% current_location for req %}'
+        c = {
+            'request': self.get_request('/foo/'),
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals('', rendered)
+
+    def testCurrentLocationForBadArgs(self):
+        t = '{% load request_utils %}{% current_location for %}'
+        self.assertRaises(
+            template.TemplateSyntaxError,
+            template.Template, t
+        )
+
+    def testEditQueryDict(self):
+        t = ('{% load request_utils %}{% edit_query_dict query_dict %}'
+             '{% append "foo" "baz" %}{% replace "page" page missing %}'
+             '{% delete "sort" "missing" %}{% update other %}'
+             '{% end_edit_query_dict %}{{ query_dict.urlencode|safe }}')
+        c = {
+            'query_dict': QueryDict('foo=bar&page=1&sort=name', mutable=True),
+            'page': 2,
+            'other': {'spam': 'eggs'},
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals(
+            sorted(['foo=bar', 'foo=baz', 'page=2', 'spam=eggs']),
+            sorted(rendered.split('&'))
+        )
+
+    def testEditQueryDictWithAsVar(self):
+        t = ('{% load request_utils %}{% edit_query_dict query_dict as "new" %}\n'
+             '    {% replace "foo" "baz" %}\n'
+             '    {# Comments are allowed #}\n'
+             '    {% append missing "value" %}\n'
+             '{% end_edit_query_dict %}{{ new.urlencode|safe }}|{{ query_dict.urlencode|safe }}')
+        c = {
+            'query_dict': QueryDict('foo=bar'),
+        }
+        rendered = self.render_template(t, c)
+        self.assertEquals('foo=baz|foo=bar', rendered)
+
+    def testEditQueryDictNotInContext(self):
+        t = '{% load request_utils %}{% edit_query_dict query_dict as "edited" %}{% delete "foo" %}{% end_edit_query_dict %}{{ edited }}'
+        rendered = self.render_template(t)
+        self.assertEquals('', rendered)
+
+    def testEditQueryDictBadArgs(self):
+        for t in (
+            '{% load request_utils %}{% edit_query_dict %}{% end_edit_query_dict %}',
+            '{% load request_utils %}{% edit_query_dict qd %}{% append "foo" %}{% end_edit_query_dict %}',
+            '{% load request_utils %}{% edit_query_dict qd %}{% frobnicate "foo" %}{% end_edit_query_dict %}',
+            '{% load request_utils %}{% edit_query_dict qd %}text{% end_edit_query_dict %}',
+            '{% load request_utils %}{% edit_query_dict qd %}{% delete "foo" %}',
+        ):
+            self.assertRaises(
+                template.TemplateSyntaxError,
+                template.Template, t
+            )
+
+    def testFreezeQueryDict(self):
+        from request_utils.datastructures import FrozenQueryDict
+        t = '{% load request_utils %}{% freeze_query_dict query_dict as "frozen" %}{% clone_query_dict frozen as "q" %}{% append_key q "a" "3" %}{{ frozen.urlencode|safe }}|{{ q.urlencode|safe }}'
+        c = template.Context({
+            'query_dict': QueryDict('b=2&a=1'),
+        })
+        rendered = template.Template(t).render(c)
+        self.assertEquals('a=1&b=2|a=1&a=3&b=2', rendered)
+        self.assertTrue(isinstance(c['frozen'], FrozenQueryDict))
+
+    def testFreezeQueryDictBadArgs(self):
+        t = '{% load request_utils %}{% freeze_query_dict query_dict %}'
+        self.assertRaises(
+            template.TemplateSyntaxError,
+            template.Template, t
+        )
+
+class CallCounter(object):
+    """
+    Counts the calls to the function ``name`` of ``module`` while used as a
+    context manager.
+    """
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+        self.calls = 0
+
+    def __enter__(self):
+        self.function = getattr(self.module, self.name)
+        def counting(*args, **kwargs):
+            self.calls += 1
+            return self.function(*args, **kwargs)
+        setattr(self.module, self.name, counting)
+        return self
+
+    def __exit__(self, *exc_info):
+        setattr(self.module, self.name, self.function)
+
+class CurrentLocationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/foo/', {'bar': 'baz'})
+
+    def testCachedOnRequest(self):
+        from request_utils import location
+        with CallCounter(location, 'urlencode') as counter:
+            self.assertEquals('/foo/?bar=baz', location.get_current_location(self.request))
+            self.assertEquals('/foo/?bar=baz', location.get_current_location(self.request))
+        self.assertEquals(1, counter.calls)
+
+    def testInvalidatedByMutation(self):
+        from request_utils.location import get_current_location
+        self.assertEquals('/foo/?bar=baz', get_current_location(self.request))
+        self.request.GET._mutable = True
+        self.request.GET['bar'] = 'quux'
+        self.request.GET._mutable = False
+        self.assertEquals('/foo/?bar=quux', get_current_location(self.request))
+
+    def testInvalidatedByReplacement(self):
+        from request_utils.location import get_current_location
+        self.assertEquals('/foo/?bar=baz', get_current_location(self.request))
+        self.request.GET = QueryDict('spam=eggs')
+        self.assertEquals('/foo/?spam=eggs', get_current_location(self.request))
+        self.request.path = '/bar/'
+        self.assertEquals('/bar/?spam=eggs', get_current_location(self.request))
+
+class RequestLocationTestCase(unittest.TestCase):
+    def setUp(self):
+        from request_utils.context_processors import request_location
+        self.request = RequestFactory().get('/foo/', {'b': '2', 'a': '1', 'utm_source': 'x'})
+        self.location = request_location(self.request)['request_location']
+
+    def testAttributes(self):
+        self.assertEquals('/foo/', self.location.path)
+        self.assertEquals(self.request.GET.urlencode(), self.location.querystring)
+        self.assertEquals(self.request.get_full_path(), self.location.location)
+        self.assertEquals('a=1&b=2', self.location.canonical_querystring)
+        self.assertEquals('/foo/?a=1&b=2', self.location.canonical_location)
+        self.assertEquals('http://testserver', self.location.absolute_base)
+
+    def testComputedOnce(self):
+        from request_utils import location
+        with CallCounter(location, 'urlencode') as counter:
+            self.location.location
+            self.assertEquals(self.request.get_full_path(), self.location.location)
+            self.assertEquals(self.request.GET.urlencode(), self.location.querystring)
+        self.assertEquals(1, counter.calls)
+
+    def testUsedByTags(self):
+        t = template.Template('{% load request_utils %}{% current_location canonical %} {% qualified_url "/baz/" %}')
+        c = template.Context({'request_location': self.location})
+        self.assertEquals('/foo/?a=1&b=2 http://testserver/baz/', t.render(c))
+
+    def testOtherValuesIgnored(self):
+        t = template.Template('{% load request_utils %}{% current_location %} {% qualified_url "/baz/" %}{% qualified_urls paths as "urls" %} {{ urls.0 }}')
+        c = template.Context({
+            'request_location': 'not a location',
+            'request': RequestFactory().get('/other/'),
+            'paths': ['/spam/'],
+        })
+        self.assertEquals('/other/ http://testserver/baz/ http://testserver/spam/', t.render(c))
+
+    def testExplicitRequestWins(self):
+        other = RequestFactory().get('/other/')
+        t = template.Template('{% load request_utils %}{% current_location for other %}')
+        c = template.Context({'request_location': self.location, 'other': other})
+        self.assertEquals('/other/', t.render(c))
+
+class AbsoluteURITestCase(unittest.TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/foo/bar/')
+
+    def testMatchesRequest(self):
+        from request_utils.location import build_absolute_uri
+        for location in ('/baz/', 'baz/', '../baz', '//other/baz',
+                         'https://example.com/', '', u'/caf\xe9/'):
+            self.assertEquals(
+                self.request.build_absolute_uri(location),
+                build_absolute_uri(location, self.request)
+            )
+
+    def testBaseCachedOnRequest(self):
+        from request_utils.location import build_absolute_uri
+        build_absolute_uri('/', self.request)
+        self.request.get_host = None
+        self.assertEquals(
+            'http://testserver/baz/',
+            build_absolute_uri('/baz/', self.request)
+        )
+
+    def testBaseURLSetting(self):
+        from django.conf import settings
+        from request_utils.location import build_absolute_uri
+        settings.REQUEST_UTILS_BASE_URL = 'https://example.com/'
+        try:
+            self.assertEquals(
+                'https://example.com/baz/',
+                build_absolute_uri('/baz/', self.request)
+            )
+            self.assertEquals(
+                'https://example.com/baz/',
+                build_absolute_uri('baz/')
+            )
+            t = template.Template('{% load request_utils %}{% qualified_url "/baz/" %}')
+            self.assertEquals(
+                'https://example.com/baz/',
+                t.render(template.Context({}))
+            )
+        finally:
+            del settings.REQUEST_UTILS_BASE_URL
+
+class URLEncodeTestCase(unittest.TestCase):
+    def testMatchesQueryDict(self):
+        from request_utils.encoding import urlencode
+        query_dict = QueryDict('a=1&a=2&b=x+y&next=/a%26b/&c=caf%C3%A9&d=')
+        self.assertEquals(query_dict.urlencode(), urlencode(query_dict))
+        self.assertEquals(
+            query_dict.urlencode(safe='/'),
+            urlencode(query_dict, safe='/')
+        )
+        self.assertEquals('', urlencode(QueryDict('')))
+
+    def testWriter(self):
+        from request_utils.encoding import QueryStringWriter
+        key_prefixes = {}
+        for prefixes in (None, key_prefixes):
+            writer = QueryStringWriter('utf-8', key_prefixes=prefixes)
+            writer.write_encoded('')
+            writer.write('a', 1)
+            writer.write_list('b', [])
+            writer.write_encoded('c=d')
+            writer.write_list(u'caf\xe9', [u'x y', 'z'])
+            self.assertEquals('a=1&c=d&caf%C3%A9=x+y&caf%C3%A9=z', writer.getvalue())
+        self.assertEquals(['a', u'caf\xe9'], sorted(key_prefixes.keys()))
+
+class FrozenQueryDictTestCase(unittest.TestCase):
+    def testCanonical(self):
+        from request_utils.datastructures import FrozenQueryDict
+        first = FrozenQueryDict.from_query_dict(QueryDict('b=2&a=1&a=0'))
+        second = FrozenQueryDict([('a', ['1', '0']), ('b', ['2'])])
+        self.assertEquals(first, second)
+        self.assertEquals(hash(first), hash(second))
+        self.assertEquals('a=1&a=0&b=2', first.urlencode())
+        self.assertEquals(1, len(set([first, second])))
+        self.assertNotEqual(first, FrozenQueryDict([('a', ['0', '1'])]))
+
+    def testReadAccess(self):
+        from request_utils.datastructures import FrozenQueryDict
+        frozen = FrozenQueryDict([('a', ['1', '2']), ('b', [])])
+        self.assertEquals(u'2', frozen['a'])
+        self.assertEquals([u'1', u'2'], frozen.getlist('a'))
+        self.assertEquals(None, frozen.get('b'))
+        self.assertEquals([], frozen.getlist('missing'))
+        self.assertRaises(KeyError, lambda: frozen['missing'])
+        self.assertEquals(['a', 'b'], list(frozen))
+
+    def testImmutable(self):
+        from request_utils.datastructures import FrozenQueryDict
+        frozen = FrozenQueryDict([('a', ['1'])])
+        self.assertRaises(AttributeError, frozen.appendlist, 'a', '2')
+        self.assertRaises(AttributeError, frozen.__setitem__, 'a', '2')
+        self.assertRaises(AttributeError, frozen.__delitem__, 'a')
+        self.assertRaises(AttributeError, frozen.update, {'a': '2'})
+
+    def testDerive(self):
+        from request_utils.datastructures import FrozenQueryDict
+        frozen = FrozenQueryDict([('a', ['1']), ('b', ['2'])])
+        self.assertEquals('a=1&a=3&b=2', frozen.with_appended('a', '3').urlencode())
+        self.assertEquals('a=4&b=2', frozen.with_list('a', ['4']).urlencode())
+        self.assertEquals('b=2', frozen.without('a', 'missing').urlencode())
+        self.assertEquals(
+            'a=1&a=5&b=2&c=6',
+            frozen.updated(QueryDict('a=5&c=6')).urlencode()
+        )
+        self.assertEquals('a=1&b=2', frozen.urlencode())
+        derived = frozen.with_list('a', ['4'])
+        self.assertTrue(derived._data['b'] is frozen._data['b'])
+
+    def testCopyIsMutable(self):
+        from request_utils.datastructures import FrozenQueryDict
+        frozen = FrozenQueryDict([('a', ['1'])])
+        copied = frozen.copy()
+        copied['a'] = '2'
+        self.assertEquals(u'2', copied['a'])
+        self.assertEquals(u'1', frozen['a'])
+        query_dict = frozen.to_query_dict()
+        self.assertTrue(isinstance(query_dict, QueryDict))
+        self.assertEquals(u'1', query_dict['a'])
+
+class QueryStringTemplateTestCase(unittest.TestCase):
+    def testRenderKeepsOrder(self):
+        from request_utils.encoding import QueryStringTemplate
+        query_dict = QueryDict('a=1&b=2&c=3')
+        keys = [key for key, _ in query_dict.lists()]
+        querystring_template = QueryStringTemplate(query_dict, [keys[1], 'new'])
+        values = dict(query_dict.items())
+        self.assertEquals(
+            '%s=%s&%s=x+y&%s=%s&new=z' % (
+                keys[0], values[keys[0]], keys[1], keys[2], values[keys[2]]
+            ),
+            querystring_template.render([(keys[1], ['x y']), ('new', ['z'])])
+        )
+        self.assertEquals(
+            '%s=%s&%s=%s' % (
+                keys[0], values[keys[0]], keys[2], values[keys[2]]
+            ),
+            querystring_template.render([(keys[1], None)])
+        )
+        self.assertEquals(query_dict.urlencode(), querystring_template.render([]))
+
+    def testCacheReusesTemplate(self):
+        from request_utils.encoding import (
+            QueryStringTemplateCache, urlencode_with_changes
+        )
+        cache = QueryStringTemplateCache(max_size=2)
+        query_dict = QueryDict('a=1&b=2', mutable=True)
+        first = cache.get_template(query_dict, ['a'])
+        self.assertTrue(first is cache.get_template(query_dict, ['a']))
+        self.assertFalse(first is cache.get_template(query_dict, ['b']))
+        self.assertEquals(
+            'a=3&b=2',
+            urlencode_with_changes(query_dict, [('a', ['3'])], cache=cache)
+        )
+        query_dict['b'] = '4'
+        self.assertFalse(first is cache.get_template(query_dict, ['a']))
+        self.assertEquals(
+            'a=3&b=4',
+            urlencode_with_changes(query_dict, [('a', ['3'])], cache=cache)
+        )
+
+    def testCacheIsBounded(self):
+        from request_utils.encoding import QueryStringTemplateCache
+        cache = QueryStringTemplateCache(max_size=2)
+        query_dict = QueryDict('a=1&b=2&c=3')
+        first = cache.get_template(query_dict, ['a'])
+        cache.get_template(query_dict, ['b'])
+        cache.get_template(query_dict, ['c'])
+        self.assertEquals(2, len(cache.templates))
+        self.assertFalse(first is cache.get_template(query_dict, ['a']))
+
+    def testModifiedURLUsesRequestCache(self):
+        from request_utils.templatetags.request_utils import (
+            QUERYSTRING_CACHE_ATTR
+        )
+        t = template.Template('{% load request_utils %}{% for page in pages %}{% modified_url request.GET page=page %} {% endfor %}')
+        request = RequestFactory().get('/', {'q': 'search'})
+        rendered = t.render(template.Context({
+            'request': request,
+            'pages': [1, 2],
+        }))
+        self.assertEquals('?q=search&page=1 ?q=search&page=2 ', rendered)
+        cache = getattr(request, QUERYSTRING_CACHE_ATTR)
+        self.assertEquals(1, len(cache.templates))
+
+class InstrumentationTestCase(unittest.TestCase):
+    def setUp(self):
+        from request_utils import instrumentation
+        from request_utils.templatetags.request_utils import NODE_TAG_NAMES
+        self.template_render = template.Template.__dict__['_render']
+        instrumentation.install(NODE_TAG_NAMES)
+
+    def tearDown(self):
+        from request_utils import instrumentation
+        instrumentation.stop_collecting()
+        instrumentation.uninstall()
+
+    def render(self):
+        t = template.Template('{% load request_utils %}{% for i in items %}{% append_key qd "foo" i %}{% endfor %}{% current_location %}')
+        return t.render(template.Context({
+            'qd': QueryDict('', mutable=True),
+            'items': ['a', 'b', 'c'],
+            'request': RequestFactory().get('/foo/'),
+        }))
+
+    def testCollectsStats(self):
+        from request_utils import instrumentation
+        collector = instrumentation.start_collecting()
+        self.assertEquals('/foo/', self.render())
+        stats = dict([(s['tag'], s) for s in collector.summary()])
+        self.assertEquals(3, stats['append_key']['calls'])
+        self.assertEquals(1, stats['append_key']['max_query_dict_keys'])
+        self.assertEquals(1, stats['current_location']['calls'])
+        self.assertTrue(stats['append_key']['seconds'] >= 0)
+
+    def testOriginWithoutDebug(self):
+        from django.conf import settings
+        from request_utils import instrumentation
+        template_debug = settings.TEMPLATE_DEBUG
+        settings.TEMPLATE_DEBUG = False
+        try:
+            t = template.Template('{% load request_utils %}{% current_location %}', name='page.html')
+        finally:
+            settings.TEMPLATE_DEBUG = template_debug
+        collector = instrumentation.start_collecting()
+        t.render(template.Context({'request': RequestFactory().get('/foo/')}))
+        self.assertEquals(['page.html'], [s['origin'] for s in collector.summary()])
+        self.assertEquals([], instrumentation.get_template_names())
+
+    def testNoCollector(self):
+        from request_utils import instrumentation
+        self.assertEquals(None, instrumentation.get_collector())
+        self.assertEquals('/foo/', self.render())
+
+    def testUninstall(self):
+        from request_utils import instrumentation
+        from request_utils.templatetags.request_utils import QueryDictAppendNode
+        instrumentation.uninstall()
+        collector = instrumentation.start_collecting()
+        self.render()
+        self.assertEquals([], collector.summary())
+        self.assertEquals(
+            'render', QueryDictAppendNode.render.__name__
+        )
+        self.assertTrue(
+            template.Template.__dict__['_render'] is self.template_render
+        )
+
+    def testMiddleware(self):
+        from django.http import HttpResponse
+        from request_utils.middleware import InstrumentationMiddleware
+        middleware = InstrumentationMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.render()
+        response = HttpResponse()
+        self.assertTrue(middleware.process_response(request, response) is response)
+        tags = [s['tag'] for s in request.request_utils_stats.summary()]
+        self.assertEquals(['append_key', 'current_location'], sorted(tags))
+
+class CanonicalTestCase(unittest.TestCase):
+    def testCanonicalQuerystring(self):
+        from request_utils.canonical import canonical_querystring
+        self.assertEquals(
+            'a=1&b=1&b=2',
+            canonical_querystring(QueryDict('b=2&a=1&b=1&empty=&utm_source=x&gclid=y'))
+        )
+        self.assertEquals(
+            canonical_querystring(QueryDict('a=1&b=2')),
+            canonical_querystring(QueryDict('b=2&a=1'))
+        )
+        self.assertEquals(
+            'utm_source=x',
+            canonical_querystring(QueryDict('utm_source=x'), denylist=())
+        )
+
+    def testDenylistSetting(self):
+        from django.conf import settings
+        from request_utils.canonical import canonical_querystring
+        settings.REQUEST_UTILS_CANONICAL_DENYLIST = ('session', 'ref_*')
+        try:
+            self.assertEquals(
+                'utm_source=x',
+                canonical_querystring(QueryDict('utm_source=x&session=1&ref_a=2'))
+            )
+        finally:
+            del settings.REQUEST_UTILS_CANONICAL_DENYLIST
+
+    def testCanonicalURL(self):
+        from request_utils.canonical import canonical_url
+        self.assertEquals('/foo/?a=1&b=2#top', canonical_url('/foo/?b=2&a=1&utm_medium=x#top'))
+        self.assertEquals('/foo/', canonical_url('/foo/?utm_medium=x'))
+        self.assertEquals('/foo/', canonical_url('/foo/'))
+
+    def testCacheKey(self):
+        from request_utils.location import get_cache_key
+        first = RequestFactory().get('/foo/?a=1&b=2&utm_source=x')
+        second = RequestFactory().get('/foo/?b=2&a=1')
+        third = RequestFactory().get('/foo/?b=3&a=1')
+        self.assertEquals(get_cache_key(first), get_cache_key(second))
+        self.assertNotEqual(get_cache_key(first), get_cache_key(third))
+        self.assertTrue(get_cache_key(first, 'prefix').startswith('prefix.'))
+
+    def testTags(self):
+        t = ('{% load request_utils %}{% current_location canonical %}|'
+             '{% qualified_url "/bar/?z=1&y=2" canonical %}|'
+             '{% clone_query_dict request.GET canonical as "q" %}{% append_key q "c" "3" %}{{ q.urlencode|safe }}|'
+             '{% freeze_query_dict request.GET canonical as "f" %}{{ f.urlencode|safe }}')
+        request = RequestFactory().get('/foo/?b=2&a=1&utm_source=x&e=')
+        rendered = template.Template(t).render(template.Context({
+            'request': request,
+        }))
+        self.assertEquals(
+            '/foo/?a=1&b=2|http://testserver/bar/?y=2&z=1|a=1&b=2&c=3|a=1&b=2',
+            rendered
+        )
+
+    def testTagBadArgs(self):
+        t = '{% load request_utils %}{% clone_query_dict request.GET canonical %}'
+        self.assertRaises(
+            template.TemplateSyntaxError,
+            template.Template, t
+        )
+
+class QueryBuilderTestCase(unittest.TestCase):
+    def testWithParams(self):
+        from request_utils.query import with_params
+        query_dict = QueryDict('sort=name&q=term')
+        builder = with_params(query_dict, page=2).without('sort')
+        self.assertEquals('?q=term&page=2', builder.url())
+        self.assertEquals('/search/?q=term&page=2', builder.url('/search/'))
+        self.assertEquals(u'name', query_dict['sort'])
+
+    def testImmutable(self):
+        from request_utils.query import QueryBuilder
+        base = QueryBuilder(QueryDict('a=1'))
+        self.assertEquals('?a=1&b=2&b=3', base.with_params(b=[2, 3]).url())
+        self.assertEquals('?a=1&a=2', base.appending('a', '2').url())
+        self.assertEquals('?', base.without('a').url())
+        self.assertEquals('/', base.without('a').url('/'))
+        self.assertEquals('?a=1', base.url())
+
+    def testMatchesTags(self):
+        from request_utils.query import with_params
+        query_dict = QueryDict('sort=name&page=1', mutable=True)
+        t = template.Template('{% load request_utils %}{% modified_url query_dict page=2 -sort %}')
+        rendered = t.render(template.Context({'query_dict': query_dict}))
+        self.assertEquals(
+            rendered, with_params(query_dict, page=2).without('sort').url()
+        )
+        copied = with_params(query_dict, page=2).without('sort').query_dict_copy()
+        self.assertEquals('page=2', copied.urlencode())
+        frozen = with_params(query_dict, page=2).frozen()
+        self.assertEquals('page=2&sort=name', frozen.urlencode())
+
+    def testAbsoluteURL(self):
+        from request_utils.query import with_params
+        request = RequestFactory().get('/foo/')
+        builder = with_params(QueryDict(''), page=2)
+        self.assertEquals(
+            'http://testserver/foo/?page=2',
+            builder.absolute_url(request.path, request)
+        )
+
+    def testFunctions(self):
+        from request_utils import query
+        query_dict = query.new_query_dict()
+        query.append_key(query_dict, 'a', '1', '2')
+        query.replace_key(query_dict, 'b', '3')
+        query.update_query_dict(query_dict, {'c': '4'})
+        query.delete_key(query_dict, 'b', 'missing')
+        self.assertEquals([u'1', u'2'], query_dict.getlist('a'))
+        self.assertFalse('b' in query_dict)
+        self.assertEquals(u'4', query_dict['c'])
+
+    def testJinjaInstall(self):
+        from request_utils import jinja
+        class Environment(object):
+            globals = {}
+        environment = Environment()
+        jinja.install(environment)
+        self.assertTrue(environment.globals['with_params'] is not None)
+        self.assertEquals(sorted(jinja.GLOBALS), sorted(environment.globals))
+
+class QueryDictOverlayTestCase(unittest.TestCase):
+    def get_overlay(self, query_string='foo=bar&foo=baz&spam=eggs'):
+        from request_utils.datastructures import QueryDictOverlay
+        self.base = QueryDict(query_string)
+        return QueryDictOverlay(self.base)
+
+    def testReturnedListsDoNotModifyBase(self):
+        overlay = self.get_overlay()
+        overlay.getlist('foo').append('added')
+        overlay.lists()[0][1].append('added')
+        overlay.setlistdefault('spam').append('ham')
+        self.assertEquals([u'bar', u'baz'], self.base.getlist('foo'))
+        self.assertEquals([u'eggs'], self.base.getlist('spam'))
+        self.assertEquals([u'bar', u'baz'], overlay.getlist('foo'))
+        self.assertEquals([u'eggs', u'ham'], overlay.getlist('spam'))
+        clone = overlay.copy()
+        clone.setlistdefault('foo').append('quux')
+        self.assertEquals([u'bar', u'baz'], overlay.getlist('foo'))
+
+    def testReadsFromBase(self):
+        overlay = self.get_overlay()
+        self.assertEquals(u'baz', overlay['foo'])
+        self.assertEquals([u'bar', u'baz'], overlay.getlist('foo'))
+        self.assertEquals(self.base.urlencode(), overlay.urlencode())
+        self.assertEquals(sorted(self.base.keys()), sorted(overlay))
+        self.assertRaises(KeyError, lambda: overlay['missing'])
+        self.assertEquals(None, overlay.get('missing'))
+
+    def testChangesDoNotTouchBase(self):
+        overlay = self.get_overlay()
+        overlay.appendlist('foo', 'quux')
+        overlay.setlist('new', ['1'])
+        del overlay['spam']
+        self.assertEquals([u'bar', u'baz', u'quux'], overlay.getlist('foo'))
+        self.assertEquals([u'1'], overlay.getlist('new'))
+        self.assertFalse('spam' in overlay)
+        self.assertEquals([u'bar', u'baz'], self.base.getlist('foo'))
+        self.assertEquals(u'eggs', self.base['spam'])
+        self.assertEquals(
+            sorted(['foo=bar', 'foo=baz', 'foo=quux', 'new=1']),
+            sorted(overlay.urlencode().split('&'))
+        )
+
+    def testDeleteMissingKey(self):
+        overlay = self.get_overlay()
+        self.assertRaises(KeyError, overlay.__delitem__, 'missing')
+        overlay['added'] = 'value'
+        del overlay['added']
+        self.assertFalse('added' in overlay)
+        self.assertEquals([], overlay.getlist('added'))
+
+    def testUpdate(self):
+        overlay = self.get_overlay('foo=bar')
+        overlay.update(QueryDict('foo=baz&spam=eggs'))
+        overlay.update({'ham': 'spam'})
+        self.assertEquals([u'bar', u'baz'], overlay.getlist('foo'))
+        self.assertEquals(u'eggs', overlay['spam'])
+        self.assertEquals(u'spam', overlay['ham'])
+
+    def testCopyIsIndependent(self):
+        overlay = self.get_overlay()
+        overlay['foo'] = 'one'
+        copied = overlay.copy()
+        copied.appendlist('foo', 'two')
+        del copied['spam']
+        self.assertEquals([u'one'], overlay.getlist('foo'))
+        self.assertEquals(u'eggs', overlay['spam'])
+        self.assertEquals([u'one', u'two'], copied.getlist('foo'))
+
+    def testToQueryDict(self):
+        overlay = self.get_overlay()
+        overlay['foo'] = 'one'
+        query_dict = overlay.to_query_dict()
+        self.assertTrue(isinstance(query_dict, QueryDict))
+        self.assertEquals([u'one'], query_dict.getlist('foo'))
+        self.assertEquals(u'eggs', query_dict['spam'])
+        query_dict['spam'] = 'ham'
+        self.assertEquals(u'eggs', overlay['spam'])
+
+class ConcurrencySafeTestCase(unittest.TestCase):
+    def setUp(self):
+        from django.conf import settings
+        settings.REQUEST_UTILS_CONCURRENCY_SAFE = True
+
+    def tearDown(self):
+        from django.conf import settings
+        del settings.REQUEST_UTILS_CONCURRENCY_SAFE
+
+    def testSharedQueryDictNotModified(self):
+        qd = QueryDict('foo=bar', mutable=True)
+        t = template.Template('{% load request_utils %}{% append_key qd "foo" "baz" %}{% delete_key qd "spam" %}{{ qd.urlencode }}')
+        self.assertEquals('foo=bar&amp;foo=baz', t.render(template.Context({'qd': qd})))
+        self.assertEquals('foo=bar', qd.urlencode())
+
+    def testLocalQueryDictModifiedInPlace(self):
+        t = template.Template('{% load request_utils %}{% clone_query_dict qd as "edited" %}{% for i in items %}{% append_key edited "foo" i %}{% endfor %}{{ edited.urlencode }}')
+        qd = QueryDict('foo=bar')
+        c = template.Context({'qd': qd, 'items': ['a', 'b']})
+        self.assertEquals('foo=bar&amp;foo=a&amp;foo=b', t.render(c))
+        self.assertEquals('foo=bar', qd.urlencode())
+
+    def testUnnamedQueryDictNotModified(self):
+        qd = QueryDict('foo=bar', mutable=True)
+        t = template.Template('{% load request_utils %}{% replace_key holder.qd "foo" "baz" %}{{ holder.qd.urlencode }}')
+        self.assertEquals('foo=bar', t.render(template.Context({'holder': {'qd': qd}})))
+        self.assertEquals('foo=bar', qd.urlencode())
+
+    def testConcurrentRenders(self):
+        import threading
+        t = template.Template('{% load request_utils %}{% for i in items %}{% append_key qd "n" i %}{% endfor %}{% replace_key qd "page" page %}{% modified_url qd -foo %} {% current_location %}')
+        shared = QueryDict('foo=bar', mutable=True)
+        errors = []
+
+        def worker(number):
+            try:
+                for iteration in range(50):
+                    page = str(number * 1000 + iteration)
+                    request = RequestFactory().get('/list/', {'page': page})
+                    result = t.render(template.Context({
+                        'qd': shared,
+                        'items': ['1', '2', '3'],
+                        'page': page,
+                        'request': request,
+                    }))
+                    expected = '?n=1&n=2&n=3&page=%s /list/?page=%s' % (page, page)
+                    if result != expected:
+                        errors.append((expected, result))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        self.assertEquals('foo=bar', shared.urlencode())
+
+class PageLinksTestCase(unittest.TestCase):
+    def get_page(self, number, num_pages=20):
+        from django.core.paginator import Paginator
+        return Paginator(range(num_pages), 1).page(number)
+
+    def testPageNumbers(self):
+        from request_utils.query import get_page_numbers
+        self.assertEquals([1, 2, 3, 4], get_page_numbers(1, 4, 5))
+        self.assertEquals([1, None, 5, 6, 7, None, 20], get_page_numbers(6, 20, 1))
+        self.assertEquals([1, 2, 3, 4, 5, None, 20], get_page_numbers(3, 20, 2))
+        self.assertEquals([1, None, 16, 17, 18, 19, 20], get_page_numbers(18, 20, 2))
+        self.assertEquals([1], get_page_numbers(1, 1, 5))
+
+    def testPageLinks(self):
+        from request_utils.query import PAGE_ELLIPSIS, page_links
+        links = page_links(QueryDict('q=x'), 'page', self.get_page(6), window=1)
+        self.assertEquals([
+            (1, '?q=x&page=1', False),
+            PAGE_ELLIPSIS,
+            (5, '?q=x&page=5', False),
+            (6, '?q=x&page=6', True),
+            (7, '?q=x&page=7', False),
+            PAGE_ELLIPSIS,
+            (20, '?q=x&page=20', False),
+        ], links)
+
+    def testTag(self):
+        t = template.Template('{% load request_utils %}{% page_links qd "page" page window=1 as "links" %}{% for number, url, current in links %}{% if number %}{% if current %}[{{ number }}]{% else %}<{{ url }}>{% endif %}{% else %}...{% endif %}{% endfor %}')
+        c = template.Context({'qd': QueryDict('page=3'), 'page': self.get_page(3, 5)})
+        self.assertEquals('<?page=1><?page=2>[3]<?page=4><?page=5>', t.render(c))
+        self.assertEquals('page=3', c['qd'].urlencode())
+
+    def testTagDefaultWindow(self):
+        t = template.Template('{% load request_utils %}{% page_links qd "page" page as "links" %}{{ links|length }}')
+        c = template.Context({'qd': QueryDict(''), 'page': self.get_page(10, 30)})
+        self.assertEquals('15', t.render(c))
+
+    def testSyntaxError(self):
+        self.assertRaises(
+            template.TemplateSyntaxError, template.Template,
+            '{% load request_utils %}{% page_links qd "page" page %}'
+        )
+
+class FacetLinksTestCase(unittest.TestCase):
+    def testFacetLinks(self):
+        from request_utils.query import facet_links
+        links = facet_links(QueryDict('color=red&color=blue'), 'color', ['red', 'green', 'blue'])
+        self.assertEquals([
+            ('red', '?color=blue', True),
+            ('green', '?color=red&color=blue&color=green', False),
+            ('blue', '?color=red', True),
+        ], links)
+
+    def testNonStringValues(self):
+        from request_utils.query import facet_links
+        links = facet_links(QueryDict('size=1'), 'size', [1, 2])
+        self.assertEquals([(1, '?', True), (2, '?size=1&size=2', False)], links)
+
+    def testTag(self):
+        t = template.Template('{% load request_utils %}{% facet_links qd "color" colors as "links" %}{% for value, url, selected in links %}{{ value }}{% if selected %}*{% endif %}={{ url|safe }} {% endfor %}')
+        qd = QueryDict('color=red')
+        c = template.Context({'qd': qd, 'colors': ['red', 'green']})
+        self.assertEquals('red*=? green=?color=red&color=green ', t.render(c))
+        self.assertEquals('color=red', qd.urlencode())
+
+    def testSyntaxError(self):
+        self.assertRaises(
+            template.TemplateSyntaxError, template.Template,
+            '{% load request_utils %}{% facet_links qd "color" as "links" %}'
+        )
+
+class ScratchQueryDictTestCase(unittest.TestCase):
+    def get_query_dicts(self):
+        from request_utils.datastructures import ScratchQueryDict
+        scratch = ScratchQueryDict()
+        query_dict = QueryDict('', mutable=True)
+        for qd in (scratch, query_dict):
+            qd.appendlist('foo', 'bar')
+            qd.appendlist('foo', 'baz')
+            qd['spam'] = 'eggs'
+            qd.setlist('ham', ['1', '2'])
+            qd.update({'spam': 'more'})
+            del qd['ham']
+        return scratch, query_dict
+
+    def testMatchesQueryDict(self):
+        scratch, query_dict = self.get_query_dicts()
+        self.assertEquals(sorted(query_dict.lists()), sorted(scratch.lists()))
+        self.assertEquals(query_dict['spam'], scratch['spam'])
+        self.assertEquals(query_dict.get('missing', 'x'), scratch.get('missing', 'x'))
+        self.assertEquals([], scratch.getlist('missing'))
+        self.assertRaises(KeyError, lambda: scratch['missing'])
+        self.assertEquals(sorted(query_dict.urlencode().split('&')),
+                          sorted(scratch.urlencode().split('&')))
+
+    def testInsertionOrder(self):
+        scratch, _ = self.get_query_dicts()
+        self.assertEquals(['foo', 'spam'], scratch.keys())
+        self.assertEquals('foo=bar&foo=baz&spam=eggs&spam=more', scratch.urlencode())
+        self.assertEquals('a=%2F', self.get_scratch('a', '/').urlencode())
+        self.assertEquals('a=/', self.get_scratch('a', '/').urlencode(safe='/'))
+
+    def get_scratch(self, key, value):
+        from request_utils.datastructures import ScratchQueryDict
+        scratch = ScratchQueryDict()
+        scratch[key] = value
+        return scratch
+
+    def testUnicode(self):
+        scratch = self.get_scratch('caf\xc3\xa9', 'caf\xc3\xa9')
+        self.assertEquals([u'caf\xe9'], scratch.keys())
+        self.assertEquals(u'caf\xe9', scratch[u'caf\xe9'])
+        self.assertEquals('caf%C3%A9=caf%C3%A9', scratch.urlencode())
+
+    def testCopyAndConversion(self):
+        scratch, _ = self.get_query_dicts()
+        copied = scratch.copy()
+        copied.appendlist('foo', 'quux')
+        self.assertEquals([u'bar', u'baz'], scratch.getlist('foo'))
+        query_dict = scratch.to_query_dict()
+        self.assertTrue(isinstance(query_dict, QueryDict))
+        self.assertEquals(sorted(scratch.lists()), sorted(query_dict.lists()))
+        self.assertEquals([u'eggs', u'more'], scratch.pop('spam'))
+        self.assertEquals(['foo'], scratch.keys())
+
+    def testQueryDictTag(self):
+        from request_utils.datastructures import ScratchQueryDict
+        t = template.Template('{% load request_utils %}{% query_dict as "q" %}{% append_key q "a" "1" %}{% freeze_query_dict q as "f" %}{{ q.urlencode }}|{{ f.urlencode }}')
+        c = template.Context({})
+        self.assertEquals('a=1|a=1', t.render(c))
+        self.assertTrue(isinstance(c['q'], ScratchQueryDict))
+
+class BaseQueryDictTestCase(unittest.TestCase):
+    def get_query_dicts(self):
+        from request_utils.datastructures import (
+            FrozenQueryDict, LazyQueryDict, QueryDictOverlay, ScratchQueryDict
+        )
+        scratch = ScratchQueryDict()
+        scratch.setlist('a', ['1', '2'])
+        scratch['b'] = '3'
+        return [
+            QueryDictOverlay(QueryDict('a=1&a=2&b=3')),
+            FrozenQueryDict.from_query_dict(QueryDict('a=1&a=2&b=3')),
+            scratch,
+            LazyQueryDict('a=1&a=2&b=3'),
+        ]
+
+    def testMultiValueDict(self):
+        from django import forms
+        from django.utils.datastructures import MultiValueDict
+        class Form(forms.Form):
+            a = forms.MultipleChoiceField(choices=[('1', '1'), ('2', '2')])
+            b = forms.CharField()
+        for query_dict in self.get_query_dicts():
+            self.assertTrue(isinstance(query_dict, MultiValueDict))
+            form = Form(query_dict)
+            self.assertTrue(form.is_valid())
+            self.assertEquals([u'1', u'2'], form.cleaned_data['a'])
+            self.assertEquals(u'3', form.cleaned_data['b'])
+
+    def testSharedAPI(self):
+        for query_dict in self.get_query_dicts():
+            self.assertTrue(query_dict.has_key('a'))
+            self.assertEquals(2, len(query_dict))
+            self.assertEquals([('a', u'2'), ('b', u'3')], sorted(query_dict.items()))
+            self.assertEquals([u'2', u'3'], sorted(query_dict.values()))
+            self.assertEquals('x', query_dict.get('c', 'x'))
+            self.assertEquals([u'1', u'2'], query_dict.to_query_dict().getlist('a'))
+            self.assertEquals(
+                ['a=1', 'a=2', 'b=3'], sorted(query_dict.urlencode().split('&'))
+            )
+
+    def testImmutable(self):
+        for query_dict in self.get_query_dicts()[1::2]:
+            for method, args in (('setdefault', ('a',)), ('update', ({},)),
+                                 ('pop', ('a',)), ('popitem', ()),
+                                 ('clear', ()), ('setlistdefault', ('c',))):
+                self.assertRaises(AttributeError, getattr(query_dict, method), *args)
+            self.assertEquals(2, len(query_dict))
+
+    def testMutable(self):
+        for query_dict in self.get_query_dicts()[::2]:
+            self.assertEquals(u'3', query_dict.setdefault('b', '4'))
+            self.assertEquals(('a', [u'1', u'2']), query_dict.popitem())
+            query_dict.clear()
+            self.assertRaises(KeyError, query_dict.popitem)
+
+    def testPickling(self):
+        import pickle
+        for query_dict in self.get_query_dicts():
+            for protocol in (0, 2):
+                unpickled = pickle.loads(pickle.dumps(query_dict, protocol))
+                self.assertEquals(query_dict.__class__, unpickled.__class__)
+                self.assertEquals(sorted(query_dict.lists()), sorted(unpickled.lists()))
+
+class CacheByQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.template = template.Template('{% load request_utils %}{% cache_by_query 60 keys="q,page" %}{{ value }}{% end_cache_by_query %}')
+
+    def render(self, params, value, path='/search/'):
+        return self.template.render(template.Context({
+            'request': RequestFactory().get(path, params),
+            'value': value,
+        }))
+
+    def testCachedOnSelectedKeys(self):
+        self.assertEquals('one', self.render({'q': 'x', 'page': '1'}, 'one'))
+        self.assertEquals('one', self.render({'page': '1', 'q': 'x', 'utm_source': 'y'}, 'two'))
+        self.assertEquals('three', self.render({'q': 'x', 'page': '2'}, 'three'))
+        self.assertEquals('four', self.render({'q': 'x', 'page': '1'}, 'four', path='/other/'))
+
+    def testFingerprint(self):
+        from request_utils.location import get_query_fingerprint
+        self.assertEquals(
+            get_query_fingerprint('/', QueryDict('a=1&b=2&c=3'), ['b', 'a']),
+            get_query_fingerprint('/', QueryDict('b=2&a=1'), ['a', 'b'])
+        )
+        self.assertNotEquals(
+            get_query_fingerprint('/', QueryDict('a=1&a=2'), ['a']),
+            get_query_fingerprint('/', QueryDict('a=2&a=1'), ['a'])
+        )
+
+    def testFragmentsCachedSeparately(self):
+        other = template.Template('{% load request_utils %}{% cache_by_query 60 keys=keys %}other {{ value }}{% end_cache_by_query %}')
+        self.assertEquals('one', self.render({'q': 'x'}, 'one'))
+        self.assertEquals('other two', other.render(template.Context({
+            'request': RequestFactory().get('/search/', {'q': 'x'}),
+            'value': 'two',
+            'keys': ['q', 'page'],
+        })))
+
+    def testWithoutRequest(self):
+        self.assertEquals('one', self.template.render(template.Context({'value': 'one'})))
+        self.assertEquals('two', self.template.render(template.Context({'value': 'two'})))
+
+    def testSyntaxError(self):
+        self.assertRaises(
+            template.TemplateSyntaxError, template.Template,
+            '{% load request_utils %}{% cache_by_query 60 %}{% end_cache_by_query %}'
+        )
+
+class LazyQueryDictTestCase(unittest.TestCase):
+    query_strings = (
+        '', 'a=1', 'a=1&a=2&b=3', 'a=1;b=2', 'a&b=&=c', 'a+b=c+d&a%20b=%E9',
+        'caf%C3%A9=caf%C3%A9&x=%zz', 'a=1&&b=2&a=3',
+    )
+
+    def get(self, query_string, **kwargs):
+        from request_utils.datastructures import LazyQueryDict
+        return LazyQueryDict(query_string, **kwargs)
+
+    def testMatchesQueryDict(self):
+        for query_string in self.query_strings:
+            lazy = self.get(query_string)
+            query_dict = QueryDict(query_string)
+            self.assertEquals(sorted(query_dict.lists()), sorted(lazy.lists()))
+            self.assertEquals(sorted(query_dict.keys()), sorted(lazy.keys()))
+            for key in query_dict:
+                self.assertEquals(query_dict[key], lazy[key])
+                self.assertEquals(query_dict.getlist(key), lazy.getlist(key))
+            self.assertEquals(
+                sorted(query_dict.urlencode().split('&')),
+                sorted(lazy.urlencode().split('&'))
+            )
+
+    def testDecodesOnAccess(self):
+        lazy = self.get('a=1&b=2')
+        self.assertEquals(u'1', lazy['a'])
+        self.assertEquals(['a'], lazy._decoded.keys())
+        self.assertRaises(KeyError, lambda: lazy['missing'])
+        self.assertEquals('x', lazy.get('missing', 'x'))
+        self.assertFalse('missing' in lazy)
+
+    def testLimits(self):
+        lazy = self.get('a=1&b=2&c=3', max_keys=2)
+        self.assertEquals(['a', 'b'], lazy.keys())
+        lazy = self.get('a=1&a=12345&b=123', max_value_length=3)
+        self.assertEquals([u'1'], lazy.getlist('a'))
+        self.assertEquals([u'123'], lazy.getlist('b'))
+
+    def testImmutable(self):
+        lazy = self.get('a=1')
+        self.assertRaises(AttributeError, lazy.__setitem__, 'a', '2')
+        self.assertRaises(AttributeError, lazy.appendlist, 'a', '2')
+        copied = lazy.copy()
+        copied['a'] = '2'
+        self.assertTrue(isinstance(copied, QueryDict))
+        self.assertEquals(u'1', lazy['a'])
+
+    def testMultipleValueForms(self):
+        from django import forms
+        class ColorForm(forms.Form):
+            color = forms.MultipleChoiceField(choices=[('r', 'Red'), ('g', 'Green')])
+        form = ColorForm(self.get('color=r&color=g'))
+        self.assertTrue(form.is_valid())
+        self.assertEquals([u'r', u'g'], form.cleaned_data['color'])
+
+    def testComparisonAndPickling(self):
+        import pickle
+        lazy = self.get('a=1&a=2&b=3')
+        self.assertEquals(self.get('b=3&a=1&a=2'), lazy)
+        self.assertNotEquals(self.get('a=1'), lazy)
+        for protocol in (0, 2):
+            unpickled = pickle.loads(pickle.dumps(lazy, protocol))
+            self.assertEquals([u'1', u'2'], unpickled.getlist('a'))
+
+    def testSnapshot(self):
+        from request_utils.cache import matches_snapshot, snapshot_query_dict
+        lazy = self.get('a=1&a=2')
+        self.assertTrue(matches_snapshot(lazy, snapshot_query_dict(lazy)))
+        self.assertFalse(matches_snapshot(lazy, {}))
+
+    def testMiddlewareAndTags(self):
+        from django.conf import settings
+        from request_utils.datastructures import LazyQueryDict
+        from request_utils.middleware import LazyQueryDictMiddleware
+        settings.REQUEST_UTILS_QUERY_MAX_KEYS = 3
+        try:
+            request = RequestFactory().get('/foo/', {'a': '1'})
+            request.META['QUERY_STRING'] = 'a=1&b=2&c=3&d=4'
+            LazyQueryDictMiddleware().process_request(request)
+        finally:
+            del settings.REQUEST_UTILS_QUERY_MAX_KEYS
+        self.assertTrue(isinstance(request.GET, LazyQueryDict))
+        t = template.Template('{% load request_utils %}{% clone_query_dict request.GET as "q" %}{% append_key q "a" "5" %}{% delete_key q "b" %}{{ q.urlencode|safe }}|{% modified_url request.GET b="x" -c %}|{% current_location %}|{% freeze_query_dict request.GET as "f" %}{{ f.urlencode }}')
+        result = t.render(template.Context({'request': request})).split('|')
+        self.assertEquals(['a=1', 'a=5', 'c=3'], sorted(result[0].split('&')))
+        self.assertEquals(['?a=1', 'b=x'], sorted(result[1].split('&')))
+        self.assertEquals('/foo/?', result[2][:6])
+        self.assertEquals(['a=1', 'b=2', 'c=3'], sorted(result[2][6:].split('&')))
+        self.assertEquals('a=1&amp;b=2&amp;c=3', result[3])
+
+class SortLinksTestCase(unittest.TestCase):
+    def testParseSort(self):
+        from request_utils.query import format_sort, parse_sort
+        order = parse_sort(['name', '-date', 'name', '-'])
+        self.assertEquals([('name', 'asc'), ('date', 'desc')], order)
+        self.assertEquals(['name', '-date'], format_sort(order))
+
+    def testParseSortNonString(self):
+        from request_utils.query import parse_sort
+        self.assertEquals([('3', 'asc'), ('4', 'desc')], parse_sort([3, -4]))
+
+    def testNonStringValues(self):
+        t = template.Template('{% load request_utils %}{% query_dict as "qd" %}{% append_key qd "sort" 2 %}{% sort_links qd "sort" "1,2" as "headers" %}{% for column, url, active, direction in headers %}{{ column }}:{{ url|safe }}:{{ active }} {% endfor %}')
+        self.assertEquals('1:?sort=1:False 2:?sort=-2:True ', t.render(template.Context()))
+
+    def testSortLinks(self):
+        from request_utils.query import sort_links
+        links = sort_links(QueryDict('q=x&sort=name'), 'sort', ['name', 'date'])
+        self.assertEquals([
+            ('name', '?q=x&sort=-name', True, 'asc'),
+            ('date', '?q=x&sort=date', False, None),
+        ], links)
+        links = sort_links(QueryDict('sort=-name'), 'sort', ['name'])
+        self.assertEquals([('name', '?sort=name', True, 'desc')], links)
+
+    def testMultiple(self):
+        from request_utils.query import sort_links
+        links = sort_links(QueryDict('sort=name&sort=-date'), 'sort', ['name', 'date', 'size'], multiple=True)
+        self.assertEquals([
+            ('name', '?sort=-name&sort=-date', True, 'asc'),
+            ('date', '?sort=date&sort=name', True, 'desc'),
+            ('size', '?sort=size&sort=name&sort=-date', False, None),
+        ], links)
+
+    def testTag(self):
+        t = template.Template('{% load request_utils %}{% sort_links qd "sort" "name,date" as "headers" %}{% for column, url, active, direction in headers %}{{ column }}:{{ url|safe }}:{{ active }}:{{ direction }} {% endfor %}')
+        c = template.Context({'qd': QueryDict('sort=-date')})
+        self.assertEquals('name:?sort=name:False:None date:?sort=date:True:desc ', t.render(c))
+
+    def testTagMultiple(self):
+        t = template.Template('{% load request_utils %}{% sort_links qd "sort" columns multiple as "headers" %}{{ headers.0.1|safe }}')
+        c = template.Context({'qd': QueryDict('sort=-date'), 'columns': ['name']})
+        self.assertEquals('?sort=name&sort=-date', t.render(c))
+
+    def testSyntaxError(self):
+        self.assertRaises(
+            template.TemplateSyntaxError, template.Template,
+            '{% load request_utils %}{% sort_links qd "sort" columns %}'
+        )
+
+class QualifiedURLsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/foo/')
+
+    def testQualifiedURLs(self):
+        from request_utils.query import qualified_urls
+
+        class Item(object):
+            def get_absolute_url(self):
+                return u'/caf\xe9/'
+
+        urls = qualified_urls(['/a/', 'b/', Item(), '/c/?b=2&a=1'], self.request)
+        self.assertFalse(isinstance(urls, list))
+        self.assertEquals([
+            'http://testserver/a/',
+            'http://testserver/foo/b/',
+            'http://testserver/caf%C3%A9/',
+            'http://testserver/c/?b=2&a=1',
+        ], list(urls))
+        self.assertEquals(
+            ['http://testserver/c/?a=1&b=2'],
+            list(qualified_urls(['/c/?b=2&a=1'], self.request, canonical=True))
+        )
+
+    def testTag(self):
+        t = template.Template('{% load request_utils %}{% qualified_urls paths as "urls" %}{% for url in urls %}{{ url }} {% endfor %}')
+        c = template.Context({'paths': ['/a/', '/b/'], 'request': self.request})
+        self.assertEquals('http://testserver/a/ http://testserver/b/ ', t.render(c))
+
+    def testTagResultReusable(self):
+        t = template.Template('{% load request_utils %}{% qualified_urls paths as "urls" %}{{ urls|length }}{% for url in urls %} {{ url }}{% endfor %}{% for url in urls %} {{ url }}{% endfor %}')
+        c = template.Context({'paths': ['/a/'], 'request': self.request})
+        self.assertEquals('1 http://testserver/a/ http://testserver/a/', t.render(c))
+
+    def testTagWithoutRequest(self):
+        t = template.Template('{% load request_utils %}{% qualified_urls paths as "urls" %}{% for url in urls %}{{ url }}{% endfor %}')
+        self.assertEquals('', t.render(template.Context({'paths': ['/a/']})))
+
+    def testSyntaxError(self):
+        self.assertRaises(
+            template.TemplateSyntaxError, template.Template,
+            '{% load request_utils %}{% qualified_urls paths %}'
+        )
+
+class TagArgumentsTestCase(unittest.TestCase):
+    def parse(self, contents, **kwargs):
+        from request_utils.templatetags.request_utils import parse_arguments
+        token = template.Token(template.TOKEN_BLOCK, contents)
+        return parse_arguments(template.Parser([]), token, **kwargs)
+
+    def testParse(self):
+        from request_utils.templatetags.request_utils import Expression, Literal
+        arguments = self.parse(
+            'tag qd "key" size=10 canonical for req as "name"',
+            keywords=('size', 'other'), flags=('canonical',), suffixes=('for', 'as')
+        )
+        self.assertEquals('tag', arguments.tag_name)
+        self.assertEquals(2, len(arguments.args))
+        self.assertTrue(isinstance(arguments.args[0], Expression))
+        self.assertTrue(isinstance(arguments.args[1], Literal))
+        self.assertEquals('key', arguments.args[1].value)
+        self.assertEquals(10, arguments.kwargs['size'].value)
+        self.assertEquals(set(['canonical']), arguments.flags)
+        self.assertEquals('name', arguments.as_var.value)
+        self.assertTrue(isinstance(arguments.suffixes['for'], Expression))
+        self.assertEquals(5, arguments.get('other', 5).value)
+
+    def testOptionalParts(self):
+        arguments = self.parse('tag a b', flags=('canonical',), suffixes=('for', 'as'))
+        self.assertEquals(2, len(arguments.args))
+        self.assertEquals(None, arguments.as_var)
+        self.assertEquals(set(), arguments.flags)
+
+    def testRequiredArguments(self):
+        arguments = self.parse('tag canonical', flags=('canonical',), required=1)
+        self.assertEquals(1, len(arguments.args))
+        self.assertEquals(set(), arguments.flags)
+        arguments = self.parse('tag canonical canonical', flags=('canonical',), required=1)
+        self.assertEquals(1, len(arguments.args))
+        self.assertEquals(set(['canonical']), arguments.flags)
+
+    def testFlagNamedVariables(self):
+        t = template.Template('{% load request_utils %}{% qualified_url canonical %}')
+        c = template.Context({'canonical': '/path/?b=2&a=1', 'request': RequestFactory().get('/')})
+        self.assertEquals('http://testserver/path/?b=2&a=1', t.render(c))
+        t = template.Template('{% load request_utils %}{% clone_query_dict canonical as "x" %}{{ x.urlencode }}')
+        c = template.Context({'canonical': QueryDict('a=1')})
+        self.assertEquals('a=1', t.render(c))
+
+    def testKeywordErrors(self):
+        self.assertRaises(
+            template.TemplateSyntaxError, self.parse, 'tag a other=1',
+            keywords=('size',)
+        )
+        self.assertRaises(
+            template.TemplateSyntaxError, self.parse, 'tag a size=1 size=2',
+            keywords=('size',)
+        )
+
+class WarmupTestCase(unittest.TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        from django.conf import settings
+        self.directory = tempfile.mkdtemp()
+        for name, source in (
+            ('good.html', '{% load request_utils %}{% modified_url request.GET page=2 %}'),
+            ('bad.html', '{% load request_utils %}{% append_key %}'),
+        ):
+            f = open(os.path.join(self.directory, name), 'w')
+            f.write(source)
+            f.close()
+        self.template_dirs = settings.TEMPLATE_DIRS
+        settings.TEMPLATE_DIRS = (self.directory,)
+
+    def tearDown(self):
+        import shutil
+        from django.conf import settings
+        settings.TEMPLATE_DIRS = self.template_dirs
+        shutil.rmtree(self.directory)
+
+    def testWarmTemplates(self):
+        from request_utils.warmup import warm_templates
+        results = warm_templates(['good.html', 'bad.html', 'missing.html'])
+        self.assertEquals(['good.html', 'bad.html', 'missing.html'], [name for name, _, _ in results])
+        self.assertEquals(None, results[0][2])
+        self.assertTrue(isinstance(results[1][2], template.TemplateSyntaxError))
+        self.assertTrue(isinstance(results[2][2], template.TemplateDoesNotExist))
+
+    def testSetting(self):
+        from django.conf import settings
+        from request_utils.warmup import warm_templates
+        settings.REQUEST_UTILS_WARMUP_TEMPLATES = ['good.html']
+        try:
+            self.assertEquals(['good.html'], [name for name, _, _ in warm_templates()])
+        finally:
+            del settings.REQUEST_UTILS_WARMUP_TEMPLATES
+
+    def testCommand(self):
+        from StringIO import StringIO
+        from django.core.management import call_command
+        stdout = StringIO()
+        call_command('warm_templates', 'good.html', stdout=stdout)
+        self.assertTrue(stdout.getvalue().startswith('Compiled 1 of 1 templates'))
+        stderr = StringIO()
+        self.assertRaises(
+            SystemExit, call_command, 'warm_templates', 'bad.html',
+            stdout=StringIO(), stderr=stderr
+        )
+        self.assertTrue(stderr.getvalue().startswith('bad.html: TemplateSyntaxError'))
+
+    def testValuesShared(self):
+        first = template.Template('{% load request_utils %}{% append_key qd "shared-key" "x" %}')
+        second = template.Template('{% load request_utils %}{% append_key other "shared-key" qd|length %}')
+        self.assertTrue(first.nodelist[1].key is second.nodelist[1].key)
+        self.assertFalse(first.nodelist[1].values[0] is second.nodelist[1].values[0])
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+
+def get_warmup_templates():
+    """
+    Return the names of the templates listed in the
+    ``REQUEST_UTILS_WARMUP_TEMPLATES`` setting.
+    """
+    return tuple(getattr(settings, "REQUEST_UTILS_WARMUP_TEMPLATES", ()))
+
+def warm_templates(template_names=None):
+    """
+    Load and compile each of ``template_names``, by default the templates
+    listed in the ``REQUEST_UTILS_WARMUP_TEMPLATES`` setting.
+
+    Templates are loaded with ``get_template``, so that the cached template
+    loader, when enabled, keeps them compiled for the rest of the process.
+    Return a list of ``(name, seconds, error)`` tuples, ``error`` being
+    ``None`` for the templates that compiled.
+    """
+    if template_names is None:
+        template_names = get_warmup_templates()
+    results = []
+    for name in template_names:
+        start = time.time()
+        try:
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError), e:
+            error = e
+        else:
+            error = None
+        results.append((name, time.time() - start, error))
+    return results